@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+benchmark suite for subtextpy
+
+Runs against an in-process subtext.testing.MockServer, so results are reproducible and need no
+live instance or keyring. Each benchmark prints one JSON line, tagged with the current git commit.
+"""
+import subtext
+from subtext import content
+from subtext.testing import MockServer
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from uuid import uuid4
+from datetime import datetime, timezone
+
+BENCHMARKS = {}
+
+def benchmark(name):
+	def decorator(func):
+		BENCHMARKS[name] = func
+		return func
+	return decorator
+
+def timed(func, *, repeat: int = 5):
+	"""
+	Run func repeat times, returning the best time in seconds and the last result.
+	"""
+	best = None
+	result = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = func()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best, result
+
+def setup_server(args, *, messages: int = 0, members: int = 0, content_size: int = 64, bandwidth=None):
+	server = MockServer(latency=args.latency, bandwidth=bandwidth, default_page_size=args.page_size).start()
+	user_id = server.add_user('bench')
+	member_ids = [server.add_user('member{}'.format(i)) for i in range(members)]
+	board_id = server.add_board('bench', user_id, member_ids)
+	payload = b'x' * content_size
+	for _ in range(messages):
+		server.add_message(board_id, user_id, payload)
+	
+	client = subtext.Client(server.url)
+	client.login('bench', 'password')
+	return server, client, client.get_board(board_id)
+
+@benchmark("pagination")
+def bench_pagination(args):
+	server, client, board = setup_server(args, messages=args.messages)
+	try:
+		before = server.request_count
+		seconds, count = timed(lambda: sum(1 for _ in board.get_messages(page_size=args.page_size)), repeat=args.repeat)
+		return {'items': count, 'seconds': seconds, 'items_per_second': count / seconds, 'requests_per_run': (server.request_count - before) / args.repeat}
+	finally:
+		server.stop()
+
+@benchmark("member_hydration")
+def bench_member_hydration(args):
+	server, client, board = setup_server(args, members=args.members)
+	try:
+		def hydrate():
+			board.refresh()
+			for member in board.members:
+				member.refresh()
+			return len(board.members)
+		before = server.request_count
+		seconds, count = timed(hydrate, repeat=args.repeat)
+		return {'items': count, 'seconds': seconds, 'requests_per_run': (server.request_count - before) / args.repeat}
+	finally:
+		server.stop()
+
+@benchmark("send")
+def bench_send(args):
+	server, client, board = setup_server(args)
+	try:
+		payload = content.TextContent(text="benchmark message").to_bytes()
+		def send():
+			for _ in range(args.sends):
+				board.send_message(payload)
+			return args.sends
+		seconds, count = timed(send, repeat=args.repeat)
+		return {'items': count, 'seconds': seconds, 'items_per_second': count / seconds}
+	finally:
+		server.stop()
+
+@benchmark("page_decoding")
+def bench_page_decoding(args):
+	server, client, board = setup_server(args, messages=args.page_size, content_size=256)
+	try:
+		page = list(board.get_messages(page_size=args.page_size))
+	finally:
+		server.stop()
+	
+	seconds, result = timed(lambda: content.parse_many(page), repeat=args.repeat)
+	return {'items': len(result), 'seconds': seconds, 'items_per_second': len(result) / seconds}
+
+@benchmark("file_content")
+def bench_file_content(args):
+	data = os.urandom(args.file_size)
+	encoded = content.FileContent(name="bench.bin", type="application/octet-stream", data=data).to_bytes()
+	seconds, _ = timed(lambda: content.parse_content("FileMessage", encoded), repeat=args.repeat)
+	return {'bytes': len(encoded), 'seconds': seconds, 'bytes_per_second': len(encoded) / seconds}
+
+@benchmark("blob_store")
+def bench_blob_store(args):
+	"""
+	Refresh file messages carrying the same payload, with and without a blob store. With a store, the
+	first run (the miss) is reported separately from the runs served from the store.
+	"""
+	import tempfile
+	from subtext.blobstore import BlobStore
+	
+	server, client, board = setup_server(args)
+	try:
+		data = os.urandom(args.file_size)
+		payload = content.FileContent(name="bench.bin", type="application/octet-stream", data=data)
+		send_seconds, _ = timed(lambda: board.send_message(payload.to_bytes(), type="FileMessage"), repeat=args.repeat)
+		messages = list(board.get_messages())
+		
+		def refresh_all():
+			before = server.bytes_sent
+			for message in messages:
+				message.content = None
+				message.refresh()
+			return server.bytes_sent - before
+		
+		plain_seconds, plain_bytes = timed(refresh_all, repeat=args.repeat)
+		with tempfile.TemporaryDirectory() as path:
+			client.ctx.blob_store = BlobStore(path)
+			# The first run fills the store, so later runs are hits
+			miss_seconds, miss_bytes = timed(refresh_all, repeat=1)
+			store_seconds, store_bytes = timed(refresh_all, repeat=args.repeat)
+			client.ctx.blob_store = None
+		return {
+			'items': len(messages),
+			'send_seconds': send_seconds,
+			'plain_seconds': plain_seconds,
+			'plain_bytes': plain_bytes,
+			'miss_seconds': miss_seconds,
+			'miss_bytes': miss_bytes,
+			'store_seconds': store_seconds,
+			'store_bytes': store_bytes
+		}
+	finally:
+		server.stop()
+
+# Compressible chat-like text for the compression benchmark
+SAMPLE_TEXT = "The quick brown fox jumps over the lazy dog while the server pages through message history. "
+
+@benchmark("compression")
+def bench_compression(args):
+	"""
+	Bytes on the wire and end-to-end latency over a bandwidth-limited link, with and without
+	response, upload and content compression.
+	"""
+	text = content.TextContent(text=SAMPLE_TEXT * 40)
+	plain = text.to_bytes()
+	wrapped = content.CompressedContent.wrap(text)
+	
+	server, client, board = setup_server(args, bandwidth=args.bandwidth)
+	try:
+		# The same page, with each message compressed as content
+		wrapped_board = client.get_board(server.add_board('wrapped', client.ctx.user_id(), []))
+		for _ in range(args.page_size):
+			server.add_message(board.id, client.ctx.user_id(), plain, type="TextMessage")
+			server.add_message(wrapped_board.id, client.ctx.user_id(), wrapped.to_bytes(), type=wrapped.canon_type())
+		# Sends go elsewhere, so they don't grow the page
+		sink = client.get_board(server.add_board('sink', client.ctx.user_id(), []))
+		
+		results = {'bandwidth': args.bandwidth}
+		for name, transport_compression, message, page_board in (
+			('plain', False, text, board),
+			('transport', True, text, board),
+			('content', False, wrapped, wrapped_board)
+		):
+			client.ctx.transport.headers['Accept-Encoding'] = 'gzip, deflate' if transport_compression else 'identity'
+			client.ctx.compress_min_size = 1024 if transport_compression else None
+			payload = message.to_bytes()
+			
+			before = server.bytes_sent
+			seconds, _ = timed(lambda: list(page_board.get_messages(page_size=args.page_size)), repeat=args.repeat)
+			results[name + '_page_bytes'] = (server.bytes_sent - before) // args.repeat
+			results[name + '_page_seconds'] = seconds
+			
+			before = server.bytes_received
+			seconds, _ = timed(lambda: sink.send_message(payload, type=message.canon_type()), repeat=args.repeat)
+			results[name + '_send_bytes'] = (server.bytes_received - before) // args.repeat
+			results[name + '_send_seconds'] = seconds
+		return results
+	finally:
+		server.stop()
+
+@benchmark("structured_content")
+def bench_structured_content(args):
+	target_id = uuid4()
+	now = datetime.now(timezone.utc)
+	items = [
+		content.ReactionContent(target_id=target_id, reaction="\U0001F44D"),
+		content.ReceiptContent(target_id=target_id, read_time=now),
+		content.EditContent(target_id=target_id, text="edited text"),
+		content.DeleteContent(target_id=target_id)
+	] * (args.items // 4)
+	binary = [(x.canon_type(), x.to_bytes()) for x in items]
+	as_json = [json.dumps({'type': x.canon_type(), **{key: str(value) for key, value in x.__dict__.items()}}).encode('utf-8') for x in items]
+	
+	binary_seconds, _ = timed(lambda: [content.parse_content(type, data) for type, data in binary], repeat=args.repeat)
+	json_seconds, _ = timed(lambda: [json.loads(data) for data in as_json], repeat=args.repeat)
+	return {
+		'items': len(items),
+		'binary_bytes': sum(len(data) for _, data in binary),
+		'json_bytes': sum(len(data) for data in as_json),
+		'binary_seconds': binary_seconds,
+		'json_seconds': json_seconds
+	}
+
+@benchmark("error_mapping")
+def bench_error_mapping(args):
+	names = ["NoObjectWithId", "SessionExpired", "NotAuthorized", "UserLocked", "UnknownError"]
+	def map_errors():
+		for i in range(args.items):
+			subtext.api_error(names[i % len(names)], 400, id="x")
+		return args.items
+	seconds, count = timed(map_errors, repeat=args.repeat)
+	return {'items': count, 'seconds': seconds, 'items_per_second': count / seconds}
+
+@benchmark("stress")
+def bench_stress(args):
+	"""
+	Throughput of one Context shared by many threads. (tests/test_common.py checks that every call succeeds.)
+	"""
+	from concurrent.futures import ThreadPoolExecutor
+	
+	server, client, board = setup_server(args, messages=args.page_size * 2, members=8)
+	try:
+		# Fresh context, so concurrent first use also races instance discovery
+		shared = subtext.Client(server.url, transport=client.ctx.transport)
+		shared.login('bench', 'password')
+		
+		def work(i):
+			if i % 4 == 0:
+				return shared.instance_id == server.instance_id
+			elif i % 4 == 1:
+				return len(list(shared.get_board(board.id).get_messages(page_size=args.page_size))) == args.page_size * 2
+			elif i % 4 == 2:
+				return shared.get_user().name == 'bench'
+			else:
+				shared.heartbeat()
+				return True
+		
+		def run():
+			with ThreadPoolExecutor(max_workers=args.threads) as executor:
+				return list(executor.map(work, range(args.threads * args.calls)))
+		
+		seconds, results = timed(run, repeat=args.repeat)
+		failures = sum(1 for x in results if not x)
+		return {
+			'threads': args.threads,
+			'items': len(results),
+			'seconds': seconds,
+			'items_per_second': len(results) / seconds,
+			'failures': failures
+		}
+	finally:
+		server.stop()
+
+@benchmark("import_time")
+def bench_import_time(args):
+	"""
+	Time a bare "import subtext" in a fresh interpreter. (tests/test_imports.py checks what it loads.)
+	"""
+	cwd = os.path.dirname(os.path.abspath(__file__))
+	best = None
+	for _ in range(args.repeat):
+		stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import subtext'],
+			cwd=cwd, capture_output=True, text=True, check=True
+		).stderr
+		for line in stderr.splitlines():
+			fields = [x.strip() for x in line.split('|')]
+			if len(fields) == 3 and fields[2] == 'subtext':
+				micros = int(fields[1])
+				best = micros if best is None else min(best, micros)
+	return {'seconds': best / 1e6}
+
+def git_commit() -> str:
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+			cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+		).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return "unknown"
+
+def main():
+	parser = argparse.ArgumentParser(description="Run subtextpy benchmarks against a mock server.")
+	parser.add_argument('benchmarks', nargs='*', help="benchmarks to run (default: all): {}".format(", ".join(BENCHMARKS)))
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--latency', type=float, default=0.0, help="mock server latency per request, in seconds")
+	parser.add_argument('--bandwidth', type=float, default=1024 * 1024, help="link speed for the compression benchmark, in bytes per second")
+	parser.add_argument('--page-size', type=int, default=100)
+	parser.add_argument('--messages', type=int, default=2000)
+	parser.add_argument('--members', type=int, default=200)
+	parser.add_argument('--sends', type=int, default=200)
+	parser.add_argument('--items', type=int, default=10000)
+	parser.add_argument('--file-size', type=int, default=16 * 1024 * 1024)
+	parser.add_argument('--threads', type=int, default=64)
+	parser.add_argument('--calls', type=int, default=4, help="calls per thread in the stress benchmark")
+	args = parser.parse_args()
+	
+	for name in args.benchmarks:
+		if name not in BENCHMARKS:
+			parser.error("unknown benchmark: {}".format(name))
+	
+	commit = git_commit()
+	for name in args.benchmarks or BENCHMARKS:
+		result = BENCHMARKS[name](args)
+		print(json.dumps(dict(benchmark=name, commit=commit, **result)))
+		sys.stdout.flush()
+
+if __name__ == "__main__":
+	main()
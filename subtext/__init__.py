@@ -2,41 +2,96 @@
 """
 subtext - Official Python client API for Subtext.
 """
-from .common import ContextError, Context, SubtextObj
+from .common import ContextError, Context, SubtextObj, RequestHook, BulkResult, parse_date, fan_out
 from .error import *
 from .user import User, UserPresence
 from .key import Key
 from .board import Board, BoardEncryption, Message
-from .encryption import Encryption
-
 from . import content
 
 from uuid import UUID
 from datetime import datetime
-import iso8601
+import importlib
+import threading
+
+from typing import Optional, Union, Tuple, Dict, List, Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+	import requests
+	from .encryption import Encryption, DecryptCache
+	from .blobstore import BlobStore
+	from . import blobstore, bot, directory, metrics, presence, search, testing
 
-from typing import Optional, Union
+# Attributes loaded on first access, to keep heavy dependencies (e.g. gnupg) out of import time
+_LAZY_ATTRS = {
+	'Encryption': '.encryption',
+	'DecryptCache': '.encryption',
+	'BlobStore': '.blobstore',
+	'blobstore': None,
+	'bot': None,
+	'directory': None,
+	'encryption': None,
+	'metrics': None,
+	'presence': None,
+	'search': None,
+	'testing': None
+}
+
+def __getattr__(name: str):
+	if name not in _LAZY_ATTRS:
+		raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+	if _LAZY_ATTRS[name] is None:
+		value = importlib.import_module('.' + name, __name__)
+	else:
+		value = getattr(importlib.import_module(_LAZY_ATTRS[name], __name__), name)
+	globals()[name] = value
+	return value
+
+def __dir__():
+	return sorted(set(globals()) | set(_LAZY_ATTRS))
 
 class Client:
 	"""
 	Subtext Client API class.
 	"""
-	def __init__(self, url: str):
-		self.ctx = Context(url)
-		
-		# Check for a valid Subtext instance
-		resp = self.ctx.get('/')
-		if resp.status_code != 200 or resp.text.strip().capitalize() != "Subtext":
-			raise ValueError("Could not detect a valid Subtext instance at {}".format(self.ctx.url))
+	def __init__(self, url: str, *,
+		validate: bool = False,
+		transport: Optional['requests.Session'] = None,
+		instance_info: Optional[Tuple[str, UUID]] = None,
+		discovery_cache: Optional[str] = None,
+		discovery_ttl: float = 86400,
+		compress_min_size: Optional[int] = None
+	):
+		"""
+		The instance is checked and its name and ID are retrieved on first use of instance_name or
+		instance_id, or immediately if validate is set. If instance_info (name and ID) is given, the
+		instance is assumed to be valid. If discovery_cache is given, discovery results are stored in
+		that file for discovery_ttl seconds. A transport can be given to share its connection pool.
+		If compress_min_size is given, request bodies of at least that many bytes are sent gzipped.
+		"""
+		self.ctx = Context(url,
+			transport=transport,
+			instance_info=instance_info,
+			discovery_cache=discovery_cache,
+			discovery_ttl=discovery_ttl,
+			compress_min_size=compress_min_size
+		)
 		
-		self.instance_name = self.ctx.instance_name
-		self.instance_id = self.ctx.instance_id
+		if validate:
+			self.ctx.discover()
+	
+	@property
+	def instance_name(self) -> Optional[str]:
+		return self.ctx.instance_name
+	@property
+	def instance_id(self) -> Optional[UUID]:
+		return self.ctx.instance_id
 	
 	def login(self, user: Union[UUID, str], password: str):
 		"""
 		Log in with the given credentials.
 		"""
-		if self.ctx._session_id is not None or self.ctx._user_id is not None:
+		if self.ctx._session is not None:
 			raise ContextError("Context is already associated with a session, try logging out")
 		
 		if isinstance(user, UUID):
@@ -51,14 +106,20 @@ class Client:
 			'password': password
 		}).json()
 		
-		self.ctx._session_id = UUID(session_id)
-		self.ctx._user_id = user_id
+		try:
+			self.ctx.set_session(UUID(session_id), user_id)
+		except ContextError:
+			# Another thread logged in first, so don't leak this session
+			self.ctx.post('/Subtext/user/logout', params={
+				'sessionId': session_id
+			})
+			raise
 	
 	def create_user(self, username: str, password: str, public_key: bytes = b'\x00') -> UUID:
 		"""
 		Create a new user account.
 		"""
-		if self.ctx._session_id is not None or self.ctx._user_id is not None:
+		if self.ctx._session is not None:
 			raise ContextError("Context is already associated with a session, try logging out")
 		
 		resp = self.ctx.post('/Subtext/user/create', params={
@@ -80,12 +141,12 @@ class Client:
 		"""
 		Log out of the current session.
 		"""
+		session_id = self.ctx.session_id()
 		self.ctx.post('/Subtext/user/logout', params={
-			'sessionId': self.ctx.session_id()
+			'sessionId': session_id
 		})
 		
-		self.ctx._session_id = None
-		self.ctx._user_id = None
+		self.ctx.clear_session(session_id)
 	
 	def get_user(self, user_id: Optional[UUID] = None):
 		"""
@@ -95,31 +156,44 @@ class Client:
 		user.refresh()
 		return user
 	
+	def _users(self, users: Iterable[Union[User, UUID]]) -> List[User]:
+		"""
+		Convert users or user IDs to Users, dropping duplicates.
+		"""
+		unique = {}
+		for x in users:
+			user = x if isinstance(x, User) else User(x, self.ctx)
+			unique.setdefault(user.id, user)
+		return list(unique.values())
+	
+	def get_friends_of(self, users: Iterable[Union[User, UUID]], *, max_workers: int = 8, page_size: Optional[int] = None) -> BulkResult:
+		"""
+		Retrieve the friends of many users concurrently.
+		The result maps each user ID to a list of their friends.
+		"""
+		return fan_out(lambda user: list(user.get_friends(page_size=page_size)), self._users(users), max_workers=max_workers)
+	
+	def accept_all_friend_requests(self, *, max_workers: int = 8) -> BulkResult:
+		"""
+		Accept all pending friend requests to the logged in user concurrently.
+		The result is keyed by sender ID.
+		"""
+		# Collect the senders first, since accepting requests shifts the pagination offsets
+		senders = list(User(self.ctx.user_id(), self.ctx).get_friend_requests())
+		return fan_out(lambda user: user.accept_friend_request(), senders, max_workers=max_workers)
+	
+	def block_many(self, users: Iterable[Union[User, UUID]], *, max_workers: int = 8) -> BulkResult:
+		"""
+		Block many users concurrently.
+		"""
+		return fan_out(lambda user: user.block(), self._users(users), max_workers=max_workers)
+	
 	def get_boards(self):
 		"""
 		Retrieve all boards visible to the logged in user. (This is an iterator.)
 		"""
-		ids = set()
-		start = 0
-		while True:
-			resp = self.ctx.get("/Subtext/board", params={
-				'sessionId': self.ctx.session_id(),
-				'start': start
-			}).json()
-			start += len(resp)
-			if len(resp) <= 0:
-				break
-			for board in resp:
-				if board['id'] not in ids:
-					ids.add(board['id'])
-					yield Board(UUID(board['id']), self.ctx,
-						name=board['name'],
-						owner=User(UUID(board['ownerId'])),
-						encryption=BoardEncryption(board['encryption']),
-						last_update=iso8601.parse_date(board['lastUpdate']),
-						last_significant_update=iso8601.parse_date(board['lastSignificantUpdate']),
-						is_direct=board['isDirect']
-					)
+		for board in Board._list_data(self.ctx):
+			yield Board._from_data(board, self.ctx)
 	
 	def get_board(self, board_id: UUID):
 		"""
@@ -128,3 +202,86 @@ class Client:
 		board = Board(board_id, self.ctx)
 		board.refresh()
 		return board
+
+class ClientManager:
+	"""
+	Manages clients for many accounts across one or more Subtext instances.
+	
+	Clients for the same instance share one pooled transport, and instance discovery is done once
+	per instance, so starting N accounts costs the discovery requests plus N logins.
+	"""
+	def __init__(self, *, max_workers: int = 16, pool_size: int = 16):
+		self.max_workers = max_workers
+		self.pool_size = pool_size
+		
+		self._transports: Dict[str, 'requests.Session'] = {}
+		self._instances: Dict[str, Tuple[str, UUID]] = {}
+		self._locks: Dict[str, threading.Lock] = {}
+		self._lock = threading.Lock()
+	
+	def transport(self, url: str) -> 'requests.Session':
+		"""
+		Get the shared transport for the given instance URL.
+		"""
+		import requests
+		
+		url = url.rstrip("/")
+		with self._lock:
+			if url not in self._transports:
+				session = requests.Session()
+				adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+				session.mount('http://', adapter)
+				session.mount('https://', adapter)
+				self._transports[url] = session
+				self._locks[url] = threading.Lock()
+			return self._transports[url]
+	
+	def client(self, url: str) -> Client:
+		"""
+		Create a client (not logged in) for the given instance URL.
+		"""
+		url = url.rstrip("/")
+		transport = self.transport(url)
+		with self._locks[url]:
+			if url not in self._instances:
+				client = Client(url, validate=True, transport=transport)
+				info = client.ctx.discover()
+				# A server without instance info is checked again by the next client, so the
+				# manager doesn't keep a fallback result for its whole lifetime
+				if info != (None, None):
+					self._instances[url] = info
+				return client
+		return Client(url, transport=transport, instance_info=self._instances[url])
+	
+	def login(self, url: str, user: Union[UUID, str], password: str) -> Client:
+		"""
+		Create a client for the given instance URL and log in.
+		"""
+		client = self.client(url)
+		client.login(user, password)
+		return client
+	
+	def login_all(self, accounts: Iterable[Tuple[str, Union[UUID, str], str]]) -> List[Union[Client, Exception]]:
+		"""
+		Log in to many accounts concurrently. Each account is given as (url, user, password).
+		Returns a list in the same order, holding either the logged in client or the exception raised.
+		"""
+		from concurrent.futures import ThreadPoolExecutor
+		
+		def login(account):
+			try:
+				return self.login(*account)
+			except Exception as e:
+				return e
+		
+		with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+			return list(executor.map(login, accounts))
+	
+	def close(self):
+		"""
+		Close all shared transports.
+		"""
+		with self._lock:
+			for session in self._transports.values():
+				session.close()
+			self._transports.clear()
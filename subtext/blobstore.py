@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+subtext.blobstore - Local content-addressed store for file message payloads.
+"""
+import hashlib
+import mmap
+import os
+import threading
+
+from collections import OrderedDict
+
+from typing import Optional, Union
+
+class BlobStore:
+	"""
+	Stores file payloads on disk, keyed by their SHA-256 digest (the hash carried in FileContent headers).
+	
+	Reads are memory-mapped. When the total size exceeds max_bytes, the least recently used blobs are
+	evicted. Assign a BlobStore to Context.blob_store to serve file message refreshes from it; since
+	Message.content is bytes, those refreshes copy the payload out of the map, and only skip its download.
+	"""
+	def __init__(self, path: str, *, max_bytes: int = 1024 * 1024 * 1024):
+		self.path = path
+		self.max_bytes = max_bytes
+		
+		self.hits = 0
+		self.misses = 0
+		
+		self._sizes = OrderedDict()
+		self._total = 0
+		self._lock = threading.Lock()
+		
+		os.makedirs(path, exist_ok=True)
+		
+		# Rebuild the LRU order from access times left by previous processes
+		entries = []
+		for name in os.listdir(path):
+			if len(name) == 64 and not name.endswith('.tmp'):
+				stat = os.stat(os.path.join(path, name))
+				entries.append((stat.st_atime, name, stat.st_size))
+		for _, name, size in sorted(entries):
+			self._sizes[name] = size
+			self._total += size
+	
+	def _file(self, key: str) -> str:
+		return os.path.join(self.path, key)
+	
+	def __contains__(self, digest: bytes) -> bool:
+		return digest.hex() in self._sizes
+	
+	def __len__(self) -> int:
+		return len(self._sizes)
+	
+	@property
+	def total_bytes(self) -> int:
+		return self._total
+	
+	def put(self, data: Union[bytes, bytearray, memoryview], *, digest: Optional[bytes] = None) -> bytes:
+		"""
+		Store a blob and return its digest. If the digest is already known (e.g. from a verified
+		FileContent), pass it to skip hashing.
+		"""
+		if digest is None:
+			digest = hashlib.sha256(data).digest()
+		key = digest.hex()
+		
+		with self._lock:
+			if key in self._sizes:
+				self._sizes.move_to_end(key)
+				return digest
+		
+		tmp_path = "{}.{}.{}.tmp".format(self._file(key), os.getpid(), threading.get_ident())
+		with open(tmp_path, 'wb') as f:
+			f.write(data)
+		os.replace(tmp_path, self._file(key))
+		
+		with self._lock:
+			if key not in self._sizes:
+				self._sizes[key] = len(data)
+				self._total += len(data)
+			self._evict()
+		return digest
+	
+	def get(self, digest: bytes) -> Optional[Union[mmap.mmap, bytes]]:
+		"""
+		Return a read-only memory map of a blob, or None if it is not stored.
+		"""
+		key = digest.hex()
+		with self._lock:
+			if key not in self._sizes:
+				self.misses += 1
+				return None
+			self._sizes.move_to_end(key)
+			self.hits += 1
+		
+		try:
+			with open(self._file(key), 'rb') as f:
+				os.utime(f.fileno())
+				if os.fstat(f.fileno()).st_size <= 0:
+					# Empty files can't be mapped
+					return b''
+				return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		except FileNotFoundError:
+			with self._lock:
+				self._forget(key)
+			return None
+	
+	def remove(self, digest: bytes):
+		"""
+		Remove a blob.
+		"""
+		key = digest.hex()
+		with self._lock:
+			if key in self._sizes:
+				self._forget(key)
+				try:
+					os.remove(self._file(key))
+				except FileNotFoundError:
+					pass
+	
+	def _forget(self, key: str):
+		# Another thread may have evicted or removed it already
+		size = self._sizes.pop(key, None)
+		if size is not None:
+			self._total -= size
+	
+	def _evict(self):
+		while self._total > self.max_bytes and len(self._sizes) > 1:
+			key = next(iter(self._sizes))
+			self._forget(key)
+			try:
+				os.remove(self._file(key))
+			except FileNotFoundError:
+				pass
@@ -2,17 +2,21 @@
 """
 subtext.board
 """
-from .common import Context, SubtextObj
-# from .content import Content, parse_content
+from .common import Context, SubtextObj, Pager, parse_date, as_utc
+from .content import MemberContent, FileContent
 
 from uuid import UUID
-from datetime import datetime
-import iso8601
+from datetime import datetime, timezone
 import json
 import base64
+import struct
 
+from bisect import bisect_left, bisect_right
 from enum import Enum
-from typing import Optional, List
+from typing import Optional, List, Union, Iterable, FrozenSet, Tuple, Dict, Set, TYPE_CHECKING
+
+if TYPE_CHECKING:
+	import requests
 
 from .user import User
 
@@ -21,6 +25,47 @@ class BoardEncryption(Enum):
 	shared_key = "SharedKey"
 	none = "None"
 
+# Page size used when paging through a message window without an explicit page size
+_WINDOW_PAGE_SIZE = 100
+
+# Bytes requested to read a file message's header, when serving it from a blob store
+_FILE_HEADER_RANGE = 4096
+
+class _OffsetIndex:
+	"""
+	Known message offset to timestamp mapping for a board, under one set of server-side filters.
+	Messages are stored in chronological order, so both lists are sorted.
+	"""
+	def __init__(self, type: Optional[str], only_system: bool):
+		self.type = type
+		self.only_system = only_system
+		
+		self.offsets = []
+		self.timestamps = []
+	def get(self, offset: int) -> Optional[datetime]:
+		i = bisect_left(self.offsets, offset)
+		if i < len(self.offsets) and self.offsets[i] == offset:
+			return self.timestamps[i]
+		return None
+	def record(self, offset: int, timestamp: datetime):
+		i = bisect_left(self.offsets, offset)
+		if i < len(self.offsets) and self.offsets[i] == offset:
+			self.timestamps[i] = timestamp
+		else:
+			self.offsets.insert(i, offset)
+			self.timestamps.insert(i, timestamp)
+	def last_offset(self) -> int:
+		return self.offsets[-1] if self.offsets else -1
+	def bounds(self, time: datetime, *, strict: bool = False) -> Tuple[int, Optional[int]]:
+		"""
+		Narrow the search range for the first message at or after (if strict, after) the given time.
+		The upper bound is None if no known message is late enough.
+		"""
+		i = (bisect_right if strict else bisect_left)(self.timestamps, time)
+		lo = self.offsets[i - 1] + 1 if i > 0 else 0
+		hi = self.offsets[i] if i < len(self.offsets) else None
+		return lo, hi
+
 class Board(SubtextObj):
 	def __init__(self, id: UUID, ctx: Optional[Context] = None, *,
 		name: Optional[str] = None,
@@ -42,42 +87,138 @@ class Board(SubtextObj):
 		
 		self.is_direct = is_direct
 		
+		# Members by ID, kept up to date incrementally from member events
+		self._members: Optional[Dict[UUID, User]] = None
 		self.members = members
+		self._members_synced: Optional[datetime] = None
+		self._member_syncs = 0
+		
+		self._offset_indexes = {}
+		
+		# Number of requests the last member walk took
+		self._member_pages = 0
+	@property
+	def members(self) -> Optional[List[User]]:
+		return list(self._members.values()) if self._members is not None else None
+	@members.setter
+	def members(self, members: Optional[List[User]]):
+		self._members = {user.id: user for user in members} if members is not None else None
+		self._members_synced = None
+	@property
+	def member_ids(self) -> Optional[Set[UUID]]:
+		"""
+		IDs of this board's members, as of the last refresh.
+		"""
+		return set(self._members) if self._members is not None else None
+	def is_member(self, user: Union[User, UUID]) -> bool:
+		"""
+		Check whether a user is a member of this board, as of the last refresh.
+		"""
+		if self._members is None:
+			self.sync_members()
+		return (user.id if isinstance(user, User) else user) in self._members
 	def refresh(self):
-		resp = self.ctx.get("/Subtext/board/{}".format(self.id), params={
+		resp, validator = self.ctx.get_conditional("/Subtext/board/{}".format(self.id), self._validator, params={
 			'sessionId': self.ctx.session_id()
-		}).json()
+		})
+		if resp is None:
+			# Nothing changed, so the member list is still current too
+			self.ctx.revalidation.record_skipped(self._member_pages)
+			return
+		self._validator = validator
+		resp = resp.json()
+		
+		previous_significant_update = self.last_significant_update
 		
 		self.name = resp.get('name', None)
 		self.owner = User(UUID(resp['ownerId']), self.ctx) if resp.get('ownerId', None) else None
 		self.encryption = BoardEncryption(resp['encryption']) if resp.get('encryption', None) else None
 		
-		self.last_update = iso8601.parse_date(resp['lastUpdate']) if resp.get('lastUpdate', None) else None
-		self.last_significant_update = iso8601.parse_date(resp['lastSignificantUpdate']) if resp.get('lastSignificantUpdate', None) else None
+		self.last_update = parse_date(resp['lastUpdate']) if resp.get('lastUpdate', None) else None
+		self.last_significant_update = parse_date(resp['lastSignificantUpdate']) if resp.get('lastSignificantUpdate', None) else None
 		
 		self.is_direct = resp.get('isDirect', None)
 		
-		self.members = list(self._get_members())
+		# Membership changes are significant updates, so the member list can only have changed if that moved
+		if self._members is not None and previous_significant_update is not None and self.last_significant_update == previous_significant_update:
+			self.ctx.revalidation.record_skipped(self._member_pages)
+		else:
+			self.sync_members()
+	
+	def sync_members(self, *, resync_every: int = 32) -> bool:
+		"""
+		Bring the member list up to date.
 		
+		The first sync takes a full snapshot. Later syncs only apply the AddMember and RemoveMember
+		events sent since the previous sync. Every resync_every syncs, a full snapshot is taken again
+		and compared with the incremental state. Returns True if that comparison found a difference.
+		"""
+		if self._members is None or self._members_synced is None or self._member_syncs >= resync_every:
+			return self._snapshot_members()
+		
+		self._member_syncs += 1
+		# Replaying an event is harmless, so the inclusive since_time needs no de-duplication
+		for message in self.get_messages(only_system=True, since_time=self._members_synced):
+			self._members_synced = max(self._members_synced, message.timestamp)
+			if message.type not in ("AddMember", "RemoveMember"):
+				continue
+			if message.content is None:
+				message.refresh()
+			user_id = MemberContent.decode(message.content).user_id
+			if message.type == "AddMember":
+				self._members.setdefault(user_id, User(user_id, self.ctx))
+			else:
+				self._members.pop(user_id, None)
+		return False
+	def _snapshot_members(self) -> bool:
+		# Member events are significant updates, so none after this point is missed by the walk;
+		# events during the walk are replayed on the next sync
+		if self.last_significant_update is not None:
+			synced = self.last_significant_update
+		else:
+			# Not refreshed yet: find the latest event instead
+			latest = self.tail(1, only_system=True)
+			synced = latest[0].timestamp if latest else datetime.fromtimestamp(0, timezone.utc)
+		
+		previous = set(self._members) if self._members is not None and self._members_synced is not None else None
+		self.members = list(self._get_members())
+		self._members_synced = synced
+		self._member_syncs = 0
+		return previous is not None and previous != set(self._members)
+	
+	@staticmethod
+	def _list_data(ctx: Context, *, page_size: Optional[int] = None):
+		"""
+		Retrieve the raw data for all boards visible to the logged in user. (This is an iterator.)
+		"""
+		yield from Pager(ctx, "/Subtext/board", {
+			'sessionId': ctx.session_id()
+		}, page_size=page_size, key=lambda board: board['id'])
+	@classmethod
+	def _from_data(cls, board: dict, ctx: Context) -> 'Board':
+		"""
+		Construct a Board from an entry of the board list.
+		"""
+		return cls(UUID(board['id']), ctx,
+			name=board['name'],
+			owner=User(UUID(board['ownerId']), ctx),
+			encryption=BoardEncryption(board['encryption']),
+			last_update=parse_date(board['lastUpdate']),
+			last_significant_update=parse_date(board['lastSignificantUpdate']),
+			is_direct=board['isDirect']
+		)
 	def _get_members(self, *, page_size: Optional[int] = None):
 		"""
 		Retrieve this board's members. (This is an iterator.)
 		"""
-		ids = set()
-		start = 0
-		while True:
-			resp = self.ctx.get("/Subtext/board/{}/members".format(self.id), params={
-				'sessionId': self.ctx.session_id(),
-				'start': start,
-				'count': page_size
-			}).json()
-			start += len(resp)
-			if len(resp) <= 0:
-				break
-			for member_id in resp:
-				if member_id not in ids:
-					ids.add(member_id)
-					yield User(UUID(member_id), self.ctx)
+		pages = Pager(self.ctx, "/Subtext/board/{}/members".format(self.id), {
+			'sessionId': self.ctx.session_id()
+		}, page_size=page_size, key=str)
+		try:
+			for member_id in pages:
+				yield User(UUID(member_id), self.ctx)
+		finally:
+			self._member_pages = pages.pages
 	def add_member(self, user: User):
 		"""
 		Add a user to this board.
@@ -94,35 +235,237 @@ class Board(SubtextObj):
 			'sessionId': self.ctx.session_id(),
 			'userId': user.id
 		})
-	def get_messages(self, *, type: Optional[str] = None, only_system: bool = False, since_time: Optional[datetime] = None, page_size: Optional[int] = None):
+	def get_messages(self, *,
+		type: Optional[str] = None,
+		only_system: bool = False,
+		since_time: Optional[datetime] = None,
+		until_time: Optional[datetime] = None,
+		before: Optional[datetime] = None,
+		after: Optional[datetime] = None,
+		author: Optional[Union[User, UUID]] = None,
+		reverse: bool = False,
+		limit: Optional[int] = None,
+		fields: Optional[Iterable[str]] = None,
+		page_size: Optional[int] = None
+	):
 		"""
 		Retrieve this board's messages. (This is an iterator.)
+		
+		Messages can be filtered by author and by time: since_time and until_time are inclusive bounds,
+		after and before are exclusive, and naive times are taken to be UTC. If reverse is set, messages
+		are yielded newest first. At most limit messages are yielded.
+		If fields is given, only those Message attributes (of timestamp, author, is_system, type and
+		content) are filled in, and the others are left as None.
+		"""
+		author_id = str(author.id if isinstance(author, User) else author).lower() if author is not None else None
+		fields = frozenset(fields) if fields is not None else None
+		since_time, until_time, before, after = as_utc(since_time), as_utc(until_time), as_utc(before), as_utc(after)
+		
+		if limit is not None and limit <= 0:
+			return
+		
+		if reverse or before is not None or after is not None:
+			yield from self._get_messages_windowed(
+				type=type, only_system=only_system,
+				since_time=since_time, until_time=until_time, before=before, after=after,
+				author_id=author_id, reverse=reverse, limit=limit, fields=fields, page_size=page_size
+			)
+			return
+		
+		# Servers with cursor support page by (timestamp, ID)
+		count = 0
+		if limit is not None and author_id is None:
+			# Every row is yielded, so no more than limit are needed; with an author, rows may be dropped
+			page_size = min(page_size or limit, limit)
+		for message in Pager(self.ctx, "/Subtext/board/{}/messages".format(self.id), {
+			'sessionId': self.ctx.session_id(),
+			'type': type,
+			'onlySystem': only_system,
+			'sinceTime': since_time,
+			'untilTime': until_time,
+			'authorId': author_id
+		}, page_size=page_size, key=lambda message: message['id']):
+			# Filter on the raw data before anything is decoded
+			if author_id is not None and (message.get('authorId', None) or '').lower() != author_id:
+				continue
+			timestamp = parse_date(message['timestamp'])
+			if until_time is not None and timestamp > until_time:
+				# Messages arrive in chronological order, so nothing later can match
+				return
+			
+			yield self._message_from_json(message, timestamp, fields)
+			count += 1
+			if limit is not None and count >= limit:
+				return
+	def tail(self, n: int, *, type: Optional[str] = None, only_system: bool = False, before: Optional[datetime] = None) -> List['Message']:
+		"""
+		Retrieve the n most recent messages (optionally, those sent before the given time), oldest first.
+		"""
+		messages = list(self.get_messages(type=type, only_system=only_system, before=before, reverse=True, limit=n, page_size=n))
+		messages.reverse()
+		return messages
+	def _get_messages_windowed(self, *,
+		type: Optional[str],
+		only_system: bool,
+		since_time: Optional[datetime],
+		until_time: Optional[datetime],
+		before: Optional[datetime],
+		after: Optional[datetime],
+		author_id: Optional[str],
+		reverse: bool,
+		limit: Optional[int],
+		fields: Optional[FrozenSet[str]],
+		page_size: Optional[int]
+	):
 		"""
-		ids = set()
+		Retrieve messages within a time window, in either direction. (This is an iterator.)
+		
+		The server only pages forward by offset, so the window's bounds are located by binary search over
+		offsets, using message timestamps. Every timestamp seen is recorded in the offset index, so later
+		windowed reads of this board need few requests.
+		"""
+		index = self._offset_index(type, only_system)
+		
 		start = 0
-		while True:
-			resp = self.ctx.get("/Subtext/board/{}/messages".format(self.id), params={
-				'sessionId': self.ctx.session_id(),
-				'start': start,
-				'count': page_size,
-				'type': type,
-				'onlySystem': only_system,
-				'sinceTime': since_time
-			}).json()
-			start += len(resp)
-			if len(resp) <= 0:
+		if since_time is not None:
+			start = max(start, self._offset_of(index, since_time))
+		if after is not None:
+			start = max(start, self._offset_of(index, after, strict=True))
+		
+		ends = []
+		if before is not None:
+			ends.append(self._offset_of(index, before))
+		if until_time is not None:
+			ends.append(self._offset_of(index, until_time, strict=True))
+		end = min(ends) if ends else self._message_count(index)
+		
+		if page_size is None:
+			# Rows of other authors are dropped client-side, so limit doesn't bound the rows needed then
+			page_size = min(limit, _WINDOW_PAGE_SIZE) if limit is not None and author_id is None else _WINDOW_PAGE_SIZE
+		
+		count = 0
+		while start < end:
+			if reverse:
+				page_start = max(start, end - page_size)
+				page = self._get_message_range(index, page_start, end)
+				end = page_start
+				page.reverse()
+			else:
+				page = self._get_message_page(index, start, min(page_size, end - start))
+				start += len(page)
+			if len(page) <= 0:
 				break
-			for message in resp:
-				if message['id'] not in ids:
-					ids.add(message['id'])
-					yield Message(UUID(message['id']), self.ctx,
-						board=self,
-						timestamp=iso8601.parse_date(message['timestamp']),
-						author=User(UUID(message['authorId']), self.ctx) if message.get('authorId', None) else None,
-						is_system=message['isSystem'],
-						type=message['type'],
-						content=base64.b64decode(message['content']) if message.get('content', None) else None
-					)
+			for message, timestamp in page:
+				if author_id is not None and (message.get('authorId', None) or '').lower() != author_id:
+					continue
+				
+				yield self._message_from_json(message, timestamp, fields)
+				count += 1
+				if limit is not None and count >= limit:
+					return
+	def _offset_index(self, type: Optional[str], only_system: bool) -> '_OffsetIndex':
+		"""
+		Get the offset index for the given server-side filters.
+		"""
+		key = (type, only_system)
+		if key not in self._offset_indexes:
+			self._offset_indexes[key] = _OffsetIndex(type, only_system)
+		return self._offset_indexes[key]
+	def _get_message_page(self, index: '_OffsetIndex', start: int, count: int) -> List[Tuple[dict, datetime]]:
+		"""
+		Retrieve raw messages by offset, recording their timestamps in the offset index.
+		"""
+		resp = self.ctx.get("/Subtext/board/{}/messages".format(self.id), params={
+			'sessionId': self.ctx.session_id(),
+			'start': start,
+			'count': count,
+			'type': index.type,
+			'onlySystem': index.only_system
+		}).json()
+		page = []
+		for i, message in enumerate(resp[:count]):
+			timestamp = parse_date(message['timestamp'])
+			index.record(start + i, timestamp)
+			page.append((message, timestamp))
+		return page
+	def _get_message_range(self, index: '_OffsetIndex', start: int, end: int) -> List[Tuple[dict, datetime]]:
+		"""
+		Retrieve the raw messages from offset start up to end, in as many requests as the server's
+		maximum page size requires.
+		"""
+		page = []
+		while start + len(page) < end:
+			more = self._get_message_page(index, start + len(page), end - start - len(page))
+			if len(more) <= 0:
+				break
+			page.extend(more)
+		return page
+	def _probe(self, index: '_OffsetIndex', offset: int) -> Optional[datetime]:
+		"""
+		Get the timestamp of the message at the given offset, or None if there is no such message.
+		"""
+		timestamp = index.get(offset)
+		if timestamp is None:
+			page = self._get_message_page(index, offset, 1)
+			if len(page) <= 0:
+				return None
+			timestamp = page[0][1]
+		return timestamp
+	def _message_count(self, index: '_OffsetIndex') -> int:
+		"""
+		Find the number of messages by galloping past the last known offset, then binary searching.
+		"""
+		lo = index.last_offset() + 1
+		step = 1
+		while self._probe(index, lo + step - 1) is not None:
+			lo += step
+			step *= 2
+		hi = lo + step - 1
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self._probe(index, mid) is not None:
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+	def _offset_of(self, index: '_OffsetIndex', time: datetime, *, strict: bool = False) -> int:
+		"""
+		Find the offset of the first message sent at or after (if strict, after) the given time.
+		"""
+		lo, hi = index.bounds(time, strict=strict)
+		if hi is None:
+			hi = self._message_count(index)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			timestamp = self._probe(index, mid)
+			if timestamp is None:
+				hi = mid
+			elif timestamp < time or (strict and timestamp == time):
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+	def _message_from_json(self, message: dict, timestamp: datetime, fields: Optional[FrozenSet[str]] = None) -> 'Message':
+		"""
+		Construct a Message from its JSON representation, decoding only the requested fields.
+		"""
+		if fields is None:
+			return Message(UUID(message['id']), self.ctx,
+				board=self,
+				timestamp=timestamp,
+				author=User(UUID(message['authorId']), self.ctx) if message.get('authorId', None) else None,
+				is_system=message['isSystem'],
+				type=message['type'],
+				content=base64.b64decode(message['content']) if message.get('content', None) else None
+			)
+		return Message(UUID(message['id']), self.ctx,
+			board=self,
+			timestamp=timestamp if 'timestamp' in fields else None,
+			author=User(UUID(message['authorId']), self.ctx) if 'author' in fields and message.get('authorId', None) else None,
+			is_system=message['isSystem'] if 'is_system' in fields else None,
+			type=message['type'] if 'type' in fields else None,
+			content=base64.b64decode(message['content']) if 'content' in fields and message.get('content', None) else None
+		)
 	def send_message(self, content: bytes, *, type: Optional[str] = None, is_system: bool = False):
 		"""
 		Send a message to this board.
@@ -167,15 +510,71 @@ class Message(SubtextObj):
 		
 		self.content = content
 	def refresh(self):
-		resp = self.ctx.get("/Subtext/board/{}/messages/{}".format(self.board.id, self.id), params={
+		if self.ctx.blob_store is not None and self.content is None and self.type == "FileMessage":
+			if self._refresh_from_blob_store():
+				return
+		
+		# Without content there is nothing to revalidate
+		validator = self._validator if self.content is not None else None
+		resp, validator = self.ctx.get_conditional("/Subtext/board/{}/messages/{}".format(self.board.id, self.id), validator, params={
 			'sessionId': self.ctx.session_id()
 		})
+		if resp is None:
+			return
+		self._validator = validator
 		
+		self._apply_metadata(resp)
+		self.content = resp.content
+		
+		if self.ctx.blob_store is not None and self.type == "FileMessage":
+			self._store_blob()
+	def _apply_metadata(self, resp: 'requests.Response'):
 		if 'X-Metadata' in resp.headers:
 			metadata = json.loads(resp.headers['X-Metadata'])
-			self.timestamp = iso8601.parse_date(metadata['Timestamp']) if metadata.get('Timestamp', None) else None
+			self.timestamp = parse_date(metadata['Timestamp']) if metadata.get('Timestamp', None) else None
 			self.author = User(UUID(metadata['AuthorId']), self.ctx) if metadata.get('AuthorId', None) else None
 			self.is_system = metadata['IsSystem'] if metadata.get('IsSystem', None) else None
 			self.type = metadata['Type'] if metadata.get('Type', None) else None
+	def _refresh_from_blob_store(self) -> bool:
+		# Fetch only the start of the content; if the header's digest is stored, the payload needn't be downloaded
+		resp = self.ctx.get("/Subtext/board/{}/messages/{}".format(self.board.id, self.id), params={
+			'sessionId': self.ctx.session_id()
+		}, headers={
+			'Range': "bytes=0-{}".format(_FILE_HEADER_RANGE - 1),
+			# Ranges of an encoded response would be ranges of the compressed bytes
+			'Accept-Encoding': 'identity'
+		})
+		self._apply_metadata(resp)
+		if resp.status_code != 206:
+			# The server ignored the range and sent everything
+			self._validator = None
+			self.content = resp.content
+			self._store_blob()
+			return True
 		
-		self.content = resp.content
+		try:
+			_, _, size, digest, data_offset = FileContent.read_header(resp.content)
+		except (ValueError, IndexError, struct.error):
+			# Not plain file content (e.g. encrypted)
+			return False
+		if data_offset > len(resp.content):
+			return False
+		
+		blob = self.ctx.blob_store.get(digest)
+		if blob is None:
+			return False
+		try:
+			if len(blob) != size:
+				return False
+			# content is bytes, so the payload is copied out of the map: this saves the download, not memory
+			self.content = resp.content[:data_offset] + blob
+		finally:
+			if not isinstance(blob, bytes):
+				blob.close()
+		return True
+	def _store_blob(self):
+		try:
+			content = FileContent.decode(self.content)
+		except (ValueError, IndexError, struct.error):
+			return
+		self.ctx.blob_store.put(content.data, digest=content.digest())
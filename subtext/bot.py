@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+subtext.bot - Message dispatcher for bots.
+"""
+from .common import Context, fan_out
+from .board import Board, BoardEncryption, Message
+from .content import Content, parse_content
+from .metrics import Histogram, DEFAULT_BUCKETS
+
+from uuid import UUID
+from datetime import datetime
+import queue
+import struct
+import threading
+import time
+import zlib
+
+from typing import Optional, Union, Iterable, List, Dict, Set, Callable, Sequence, TYPE_CHECKING
+
+if TYPE_CHECKING:
+	from .encryption import Encryption
+
+class Event:
+	"""
+	A message delivered to a handler.
+	"""
+	def __init__(self, dispatcher: 'Dispatcher', board: Board, message: Message, content: Optional[Content], verified: Optional[bool]):
+		self.dispatcher = dispatcher
+		self.board = board
+		self.message = message
+		self.content = content
+		# Whether the signature was trusted, for decrypted messages
+		self.verified = verified
+	def reply(self, content: Content):
+		"""
+		Send content to the board the message came from, encrypted if the board uses GnuPG.
+		"""
+		self.dispatcher.send(self.board, content)
+
+class HandlerStats:
+	"""
+	Call counts and latency histogram for one handler.
+	"""
+	def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+		self.calls = 0
+		self.errors = 0
+		self.latency = Histogram(buckets)
+
+class Dispatcher:
+	"""
+	Polls watched boards for new messages and dispatches them to handlers registered by message type.
+	
+	Each board is assigned to one worker thread by its ID, so its messages are handled in order, while
+	different boards are handled in parallel. Each worker has a queue of at most queue_size messages;
+	when it is full, polling waits for the worker to catch up. If an Encryption is given, messages on
+	GnuPG boards are decrypted before they are parsed.
+	"""
+	def __init__(self, ctx: Context, *,
+		workers: int = 8,
+		queue_size: int = 256,
+		poll_interval: float = 1.0,
+		max_poll_workers: int = 8,
+		page_size: Optional[int] = None,
+		encryption: Optional['Encryption'] = None,
+		ignore_self: bool = True,
+		buckets: Sequence[float] = DEFAULT_BUCKETS
+	):
+		self.ctx = ctx
+		self.poll_interval = poll_interval
+		self.max_poll_workers = max_poll_workers
+		self.page_size = page_size
+		self.encryption = encryption
+		self.ignore_self = ignore_self
+		self.buckets = buckets
+		
+		# Handlers by message type; None holds handlers for every type
+		self.handlers: Dict[Optional[str], List[Callable[[Event], None]]] = {}
+		# Stats by handler, so handlers with the same name are counted separately
+		self.stats: Dict[Callable[[Event], None], HandlerStats] = {}
+		self.poll_errors = 0
+		# Messages that could not be decrypted or parsed; they are dispatched with content None
+		self.decode_errors = 0
+		# Messages that failed outside of a handler, and failures in on_error
+		self.dispatch_errors = 0
+		# Called with the event and the exception when a handler fails
+		self.on_error: Optional[Callable[[Event, Exception], None]] = None
+		
+		self.boards: Dict[UUID, Board] = {}
+		# Timestamp of the newest message seen on each board, and the IDs seen at that timestamp
+		self._since: Dict[UUID, Optional[datetime]] = {}
+		self._seen: Dict[UUID, Set[UUID]] = {}
+		self._lock = threading.Lock()
+		
+		self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+		self._workers = []
+		self._thread = None
+		self._stop = threading.Event()
+	
+	def handler(self, *types: str):
+		"""
+		Decorator that registers a handler for the given message types, or for every type if none are given.
+		"""
+		def decorator(func: Callable[[Event], None]):
+			self.add_handler(func, *types)
+			return func
+		return decorator
+	def add_handler(self, func: Callable[[Event], None], *types: str):
+		"""
+		Register a handler for the given message types, or for every type if none are given.
+		"""
+		with self._lock:
+			for type in types or (None,):
+				self.handlers[type] = self.handlers.get(type, []) + [func]
+			self.stats.setdefault(func, HandlerStats(self.buckets))
+	
+	def watch(self, boards: Iterable[Board], *, since_time: Optional[datetime] = None):
+		"""
+		Start dispatching messages from the given boards. Only messages sent after the board's current
+		last message are dispatched, unless since_time is given.
+		"""
+		for board in boards:
+			if since_time is None:
+				last = board.tail(1)
+				since = last[0].timestamp if last else None
+				seen = {last[0].id} if last else set()
+			else:
+				since = since_time
+				seen = set()
+			with self._lock:
+				if board.id not in self.boards:
+					self.boards[board.id] = board
+					self._since[board.id] = since
+					self._seen[board.id] = seen
+	def unwatch(self, boards: Iterable[Union[Board, UUID]]):
+		"""
+		Stop dispatching messages from the given boards. Messages already queued are still handled.
+		"""
+		with self._lock:
+			for x in boards:
+				board_id = x.id if isinstance(x, Board) else x
+				self.boards.pop(board_id, None)
+				self._since.pop(board_id, None)
+				self._seen.pop(board_id, None)
+	
+	def poll(self) -> int:
+		"""
+		Fetch new messages from every watched board and queue them for the workers as they arrive, so
+		fetching waits while a worker's queue is full. (start() does this in the background.) Returns
+		the number queued.
+		"""
+		with self._lock:
+			boards = list(self.boards.values())
+		result = fan_out(self._fetch, boards, max_workers=self.max_poll_workers)
+		with self._lock:
+			self.poll_errors += len(result.errors)
+		return sum(result.results.values())
+	def _fetch(self, board: Board) -> int:
+		with self._lock:
+			since = self._since.get(board.id, None)
+			seen = self._seen.get(board.id, set())
+		
+		own_id = self.ctx.user_id() if self.ignore_self else None
+		q = self._queue_for(board.id)
+		count = 0
+		for message in board.get_messages(since_time=since, page_size=self.page_size):
+			if message.id in seen:
+				continue
+			if message.timestamp != since:
+				since = message.timestamp
+				seen = set()
+			seen.add(message.id)
+			if own_id is None or message.author is None or message.author.id != own_id:
+				q.put((board, message))
+				count += 1
+			
+			# Saved as messages are queued, so a failed poll resumes where it stopped
+			with self._lock:
+				if board.id in self.boards:
+					self._since[board.id] = since
+					self._seen[board.id] = seen
+		return count
+	def _queue_for(self, board_id: UUID) -> queue.Queue:
+		# Stable across runs, unlike hash()
+		return self._queues[zlib.crc32(board_id.bytes) % len(self._queues)]
+	
+	def dispatch(self, board: Board, message: Message):
+		"""
+		Decode a message and call its handlers, in the calling thread.
+		Messages that cannot be decrypted or parsed are still dispatched, with content None.
+		"""
+		data = message.content
+		verified = None
+		decode_failed = False
+		if data is not None and board.encryption == BoardEncryption.gnupg and self.encryption is not None:
+			try:
+				result = self.encryption.try_decrypt(data, message_id=message.id)
+			except Exception:
+				result = None
+			if result is not None:
+				data, verified = result
+			else:
+				data, verified = None, False
+				decode_failed = True
+		
+		try:
+			content = parse_content(message.type, data) if data is not None else None
+		except (ValueError, IndexError, UnicodeDecodeError, struct.error):
+			content = None
+			decode_failed = True
+		if decode_failed:
+			with self._lock:
+				self.decode_errors += 1
+		event = Event(self, board, message, content, verified)
+		
+		handlers = self.handlers.get(message.type, []) + self.handlers.get(None, [])
+		for func in handlers:
+			stats = self.stats[func]
+			start = time.perf_counter()
+			try:
+				func(event)
+			except Exception as e:
+				with self._lock:
+					stats.errors += 1
+				if self.on_error is not None:
+					try:
+						self.on_error(event, e)
+					except Exception:
+						# Must not skip the remaining handlers
+						with self._lock:
+							self.dispatch_errors += 1
+			latency = time.perf_counter() - start
+			with self._lock:
+				stats.calls += 1
+				stats.latency.observe(latency)
+	def send(self, board: Board, content: Content):
+		"""
+		Send content to a board, encrypted to its members if it uses GnuPG.
+		"""
+		data = content.to_bytes()
+		if board.encryption == BoardEncryption.gnupg:
+			if self.encryption is None:
+				raise ValueError("Board is encrypted, but no Encryption was given")
+			if board.member_ids is None:
+				board.sync_members()
+			data = self.encryption.encrypt(data, list(board.members))
+		board.send_message(data, type=content.canon_type())
+	
+	def _work(self, q: queue.Queue):
+		while True:
+			item = q.get()
+			try:
+				if item is None:
+					return
+				self.dispatch(*item)
+			except Exception:
+				# Must not kill the worker
+				with self._lock:
+					self.dispatch_errors += 1
+			finally:
+				q.task_done()
+	def _run(self):
+		while not self._stop.is_set():
+			try:
+				self.poll()
+			except Exception:
+				pass
+			self._stop.wait(self.poll_interval)
+	
+	def start(self):
+		"""
+		Start the workers, and poll in a background thread every poll_interval seconds.
+		"""
+		if self._thread is not None:
+			return
+		self._stop.clear()
+		self._workers = [threading.Thread(target=self._work, args=(q,), daemon=True) for q in self._queues]
+		for worker in self._workers:
+			worker.start()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+	def stop(self):
+		"""
+		Stop polling, wait for queued messages to be handled, and stop the workers.
+		"""
+		self._stop.set()
+		if self._thread is None:
+			return
+		self._thread.join()
+		self._thread = None
+		for q in self._queues:
+			q.put(None)
+		for worker in self._workers:
+			worker.join()
+		self._workers = []
+	def join(self):
+		"""
+		Wait until every queued message has been handled.
+		"""
+		for q in self._queues:
+			q.join()
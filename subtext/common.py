@@ -2,60 +2,345 @@
 """
 subtext.common
 """
-import requests
+import gzip
+import json
+import os
+import re
+import threading
+import time
 from uuid import UUID
-from typing import Optional
+from datetime import datetime, timezone
+from typing import Optional, List, Tuple, Dict, Set, Iterable, Iterator, Callable, Any, TYPE_CHECKING
 
-from .error import api_error
+if TYPE_CHECKING:
+	import requests
+	from .blobstore import BlobStore
+
+from .error import api_error, APIError
+
+_RE_UUID = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+def path_template(path: str) -> str:
+	"""
+	Replace the object IDs in a request path with a placeholder, e.g. /Subtext/board/{id}/messages.
+	"""
+	return _RE_UUID.sub('{id}', path)
+
+def parse_date(value: str) -> datetime:
+	"""
+	Parse an ISO 8601 timestamp. (iso8601 is only imported once a timestamp needs parsing.)
+	"""
+	import iso8601
+	return iso8601.parse_date(value)
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+	"""
+	Make a datetime timezone-aware, treating a naive one as UTC, so it can be compared with parsed timestamps.
+	"""
+	if value is not None and value.tzinfo is None:
+		return value.replace(tzinfo=timezone.utc)
+	return value
 
 class ContextError(Exception):
 	"""
 	Generic context error.
 	"""
 
+class RequestHook:
+	"""
+	Receives callbacks for every request sent through a Context. Override any of the methods.
+	Paths are templates with object IDs replaced by {id}. Latency is in seconds.
+	"""
+	def before_request(self, method: str, path: str):
+		"""
+		Called before a request is sent.
+		"""
+	def after_response(self, method: str, path: str, status_code: int, latency: float, bytes_sent: int, bytes_received: int):
+		"""
+		Called when a response is received, including error responses.
+		"""
+	def on_error(self, method: str, path: str, error: Exception, latency: float):
+		"""
+		Called when a request fails, either with an APIError or a transport exception.
+		"""
+
+class Validator:
+	"""
+	Validators (ETag and Last-Modified) of a retrieved representation, and its size in bytes.
+	"""
+	__slots__ = ('etag', 'last_modified', 'size')
+	def __init__(self, etag: Optional[str], last_modified: Optional[str], size: int):
+		self.etag = etag
+		self.last_modified = last_modified
+		self.size = size
+
+class RevalidationStats:
+	"""
+	Counts the requests and bytes saved by conditional revalidation.
+	"""
+	def __init__(self):
+		self.not_modified = 0
+		self.bytes_saved = 0
+		self.requests_saved = 0
+		self._lock = threading.Lock()
+	def record_not_modified(self, size: int):
+		with self._lock:
+			self.not_modified += 1
+			self.bytes_saved += size
+	def record_skipped(self, requests: int, size: int = 0):
+		"""
+		Record requests that were not sent at all, because the data they would fetch is known to be unchanged.
+		"""
+		with self._lock:
+			self.requests_saved += requests
+			self.bytes_saved += size
+	def as_dict(self) -> dict:
+		return {
+			'not_modified': self.not_modified,
+			'bytes_saved': self.bytes_saved,
+			'requests_saved': self.requests_saved
+		}
+
 class Context:
 	"""
 	Stores Subtext client context information.
+	
+	A Context can be shared between threads. The session ID and user ID are stored together and
+	replaced atomically, so a request never sees one without the other. The transport is a
+	requests.Session, whose connection pool is thread-safe; Subtext does not use cookies, so no other
+	per-request state is shared.
 	"""
-	def __init__(self, url: str, *, session_id: Optional[UUID] = None, user_id: Optional[UUID] = None):
+	def __init__(self, url: str, *,
+		session_id: Optional[UUID] = None,
+		user_id: Optional[UUID] = None,
+		transport: Optional['requests.Session'] = None,
+		instance_info: Optional[Tuple[str, UUID]] = None,
+		discovery_cache: Optional[str] = None,
+		discovery_ttl: float = 86400,
+		compress_min_size: Optional[int] = None
+	):
+		"""
+		If a transport is given, requests are sent through it, so its connection pool can be shared
+		between contexts. If instance_info (name and ID) is given, instance discovery is skipped.
+		
+		Instance discovery is otherwise done on first use of instance_name or instance_id. If
+		discovery_cache is given, discovery results are stored in that file for discovery_ttl seconds.
+		
+		Responses are compressed if the server supports it: the transport sends Accept-Encoding and
+		decodes the response. Request bodies of at least compress_min_size bytes are sent gzipped, if
+		that makes them smaller; this is off by default, since the server must accept Content-Encoding.
+		"""
 		self.url = url.rstrip("/")
-		self._session_id = session_id
-		self._user_id = user_id
+		self._session = (session_id, user_id) if session_id is not None or user_id is not None else None
+		self._lock = threading.RLock()
+		
+		if transport is None:
+			import requests
+			transport = requests.Session()
+		self.transport = transport
+		
+		self.hooks: List[RequestHook] = []
+		self.revalidation = RevalidationStats()
+		
+		# File message payloads, keyed by digest (see subtext.blobstore)
+		self.blob_store: Optional['BlobStore'] = None
+		
+		self.discovery_cache = discovery_cache
+		self.discovery_ttl = discovery_ttl
+		self._instance_info = instance_info
+		
+		self.compress_min_size = compress_min_size
+		
+		# Path templates of listings that have returned a pagination cursor
+		self._cursor_paths: Set[str] = set()
+	
+	@property
+	def instance_name(self) -> Optional[str]:
+		return self.discover()[0]
+	@property
+	def instance_id(self) -> Optional[UUID]:
+		return self.discover()[1]
+	def discover(self) -> Tuple[Optional[str], Optional[UUID]]:
+		"""
+		Check that the URL points to a valid Subtext instance, and return its name and ID.
+		This is done at most once per context, and raises a ValueError if the instance is not valid.
+		"""
+		if self._instance_info is not None:
+			return self._instance_info
+		
+		with self._lock:
+			if self._instance_info is None:
+				self._instance_info = self._discover()
+			return self._instance_info
+	def _discover(self) -> Tuple[Optional[str], Optional[UUID]]:
+		info = self._read_discovery_cache()
+		if info is not None:
+			return info
 		
 		try:
 			resp = self.get('/Subtext').json()
-			self.instance_name = resp['instanceName']
-			self.instance_id = UUID(resp['instanceId'])
-		except:
-			self.instance_name = None
-			self.instance_id = None
+			info = (resp['instanceName'], UUID(resp['instanceId']))
+		except APIError as e:
+			# Anything but a missing endpoint (e.g. a transient 500) must not be mistaken for an old server
+			if e.status_code != 404:
+				raise
+		except (ValueError, KeyError, TypeError):
+			# Not instance info
+			pass
+		if info is None:
+			# Fall back to the plain instance check, for servers without instance info; the result isn't
+			# cached, so a server that gains instance info is picked up by the next context
+			resp = self._send('GET', '/')
+			if resp.status_code != 200 or resp.text.strip().capitalize() != "Subtext":
+				raise ValueError("Could not detect a valid Subtext instance at {}".format(self.url))
+			return (None, None)
+		self._write_discovery_cache(info)
+		return info
+	def _read_discovery_cache(self) -> Optional[Tuple[Optional[str], Optional[UUID]]]:
+		if self.discovery_cache is None:
+			return None
+		# A corrupt or foreign cache file counts as a miss
+		try:
+			with open(self.discovery_cache, 'r') as f:
+				entry = json.load(f)[self.url]
+			if time.time() - float(entry['time']) > self.discovery_ttl:
+				return None
+			name = entry['instanceName']
+			if name is not None and not isinstance(name, str):
+				return None
+			return (name, UUID(entry['instanceId']) if entry['instanceId'] is not None else None)
+		except (OSError, ValueError, KeyError, TypeError, AttributeError):
+			return None
+	def _write_discovery_cache(self, info: Tuple[Optional[str], Optional[UUID]]):
+		if self.discovery_cache is None:
+			return
+		try:
+			with open(self.discovery_cache, 'r') as f:
+				entries = json.load(f)
+		except (OSError, ValueError):
+			entries = {}
+		if not isinstance(entries, dict):
+			entries = {}
+		entries[self.url] = {
+			'instanceName': info[0],
+			'instanceId': str(info[1]) if info[1] else None,
+			'time': time.time()
+		}
+		try:
+			tmp_path = "{}.{}.tmp".format(self.discovery_cache, os.getpid())
+			with open(tmp_path, 'w') as f:
+				json.dump(entries, f)
+			os.replace(tmp_path, self.discovery_cache)
+		except OSError:
+			pass
+	
+	@property
+	def _session_id(self) -> Optional[UUID]:
+		session = self._session
+		return session[0] if session is not None else None
+	@property
+	def _user_id(self) -> Optional[UUID]:
+		session = self._session
+		return session[1] if session is not None else None
+	def session(self) -> Tuple[UUID, UUID]:
+		"""
+		Retrieve the associated session ID and user ID together, or raise a ContextError if there is none.
+		"""
+		session = self._session
+		if session is None:
+			raise ContextError("Context is not associated with a session, try logging in")
+		return session
 	def session_id(self):
 		"""
 		Retrieve the associated session ID, or raise a ContextError if there is none.
 		"""
-		if self._session_id is None:
-			raise ContextError("Context is not associated with a session, try logging in")
-		return self._session_id
+		return self.session()[0]
 	def user_id(self):
 		"""
 		Retrieve the associated user ID, or raise a ContextError if there is none.
 		"""
-		if self._user_id is None:
-			raise ContextError("Context is not associated with a session, try logging in")
-		return self._user_id
+		return self.session()[1]
+	def set_session(self, session_id: UUID, user_id: UUID):
+		"""
+		Associate this context with a session, or raise a ContextError if it already has one.
+		"""
+		with self._lock:
+			if self._session is not None:
+				raise ContextError("Context is already associated with a session, try logging out")
+			self._session = (session_id, user_id)
+	def clear_session(self, session_id: Optional[UUID] = None):
+		"""
+		Dissociate this context from its session. If a session ID is given, only that session is cleared.
+		"""
+		with self._lock:
+			if session_id is None or self._session_id == session_id:
+				self._session = None
+	
+	def add_hook(self, hook: RequestHook):
+		"""
+		Register a hook to be called for every request.
+		"""
+		with self._lock:
+			self.hooks = self.hooks + [hook]
+	def remove_hook(self, hook: RequestHook):
+		"""
+		Unregister a hook.
+		"""
+		with self._lock:
+			self.hooks = [x for x in self.hooks if x is not hook]
 	
 	def request(self, method: str, url: str, **kwargs):
 		"""
 		Send an HTTP request.
 		"""
 		if 'data' in kwargs:
-			resp = requests.request(method, self.url + url, **kwargs, headers={'Content-Type': 'application/octet-stream'})
-		else:
-			resp = requests.request(method, self.url + url, **kwargs)
+			kwargs = self._encode_body(kwargs)
+		hooks = self.hooks
+		if not hooks:
+			return self._check_response(self._send(method, url, **kwargs))
+		
+		path = path_template(url)
+		for hook in hooks:
+			hook.before_request(method, path)
+		
+		start = time.perf_counter()
+		try:
+			resp = self._send(method, url, **kwargs)
+		except Exception as e:
+			latency = time.perf_counter() - start
+			for hook in hooks:
+				hook.on_error(method, path, e, latency)
+			raise
+		latency = time.perf_counter() - start
+		
+		data = kwargs.get('data', None)
+		for hook in hooks:
+			hook.after_response(method, path, resp.status_code, latency, len(data) if data else 0, len(resp.content))
+		
+		try:
+			return self._check_response(resp)
+		except APIError as e:
+			for hook in hooks:
+				hook.on_error(method, path, e, latency)
+			raise
+	def _encode_body(self, kwargs: dict) -> dict:
+		# Done before _send, so hooks see the size actually sent
+		kwargs = dict(kwargs)
+		headers = dict(kwargs.pop('headers', None) or {})
+		headers['Content-Type'] = 'application/octet-stream'
 		
-		# Handle error
-		if resp.status_code // 100 != 2:
-			if resp.headers.get('Content-Type', None).startswith('application/json'):
+		data = kwargs['data']
+		if self.compress_min_size is not None and data is not None and len(data) >= self.compress_min_size:
+			compressed = gzip.compress(data, compresslevel=6)
+			if len(compressed) < len(data):
+				kwargs['data'] = compressed
+				headers['Content-Encoding'] = 'gzip'
+		kwargs['headers'] = headers
+		return kwargs
+	def _send(self, method: str, url: str, **kwargs):
+		return self.transport.request(method, self.url + url, **kwargs)
+	def _check_response(self, resp):
+		if resp.status_code // 100 != 2 and resp.status_code != 304:
+			if (resp.headers.get('Content-Type', None) or '').startswith('application/json'):
 				errdata = resp.json()
 				if 'error' in errdata:
 					errmsg = errdata.pop('error')
@@ -67,6 +352,31 @@ class Context:
 		
 		return resp
 	
+	def get_conditional(self, url: str, validator: Optional['Validator'], **kwargs) -> Tuple[Optional['requests.Response'], Optional['Validator']]:
+		"""
+		Send an HTTP GET request, revalidating a previously retrieved representation.
+		Returns the response and its validator, or None and the old validator if the representation
+		has not been modified since the validator was obtained.
+		"""
+		if validator is not None:
+			headers = dict(kwargs.pop('headers', None) or {})
+			if validator.etag is not None:
+				headers['If-None-Match'] = validator.etag
+			if validator.last_modified is not None:
+				headers['If-Modified-Since'] = validator.last_modified
+			kwargs['headers'] = headers
+		
+		resp = self.request('GET', url, **kwargs)
+		if resp.status_code == 304:
+			self.revalidation.record_not_modified(validator.size if validator is not None else 0)
+			return None, validator
+		
+		etag = resp.headers.get('ETag', None)
+		last_modified = resp.headers.get('Last-Modified', None)
+		if etag is None and last_modified is None:
+			return resp, None
+		return resp, Validator(etag, last_modified, len(resp.content))
+	
 	def get(self, url: str, **kwargs):
 		"""
 		Send an HTTP GET request.
@@ -100,8 +410,110 @@ class SubtextObj:
 	def __init__(self, id: UUID, ctx: Optional[Context] = None):
 		self.id = id
 		self.ctx = ctx
+		
+		# Validator of the representation this object was last refreshed from
+		self._validator: Optional[Validator] = None
 	def refresh(self):
 		"""
 		Update this object with the latest data from the Subtext instance.
 		"""
 		raise NotImplementedError()
+
+class Pager:
+	"""
+	Iterates over the items of a paged listing.
+	
+	If the server returns a cursor for the next page (in X-Next-Cursor), pages are requested by cursor,
+	which costs the server the same for every page and never repeats an item. Otherwise pages are
+	requested by offset, and items whose key was already seen are skipped. Servers omit the cursor on
+	the last page, so once a listing has returned a cursor, the final empty page isn't requested.
+	"""
+	def __init__(self, ctx: Context, url: str, params: Dict[str, Any], *,
+		page_size: Optional[int] = None,
+		key: Optional[Callable[[Any], Any]] = None
+	):
+		self.ctx = ctx
+		self.url = url
+		self.params = params
+		self.page_size = page_size
+		self.key = key
+		
+		# Pages requested so far
+		self.pages = 0
+	def __iter__(self) -> Iterator[Any]:
+		template = path_template(self.url)
+		seen = None
+		cursor = None
+		start = 0
+		while True:
+			params = dict(self.params, count=self.page_size)
+			if cursor is not None:
+				params['cursor'] = cursor
+			else:
+				params['start'] = start
+			resp = self.ctx.get(self.url, params=params)
+			self.pages += 1
+			items = resp.json()
+			if len(items) <= 0:
+				return
+			start += len(items)
+			
+			cursor = resp.headers.get('X-Next-Cursor', None)
+			if cursor is not None:
+				self.ctx._cursor_paths.add(template)
+			elif seen is None and self.key is not None and template not in self.ctx._cursor_paths:
+				# Paging by offset: items can shift between pages
+				seen = set()
+			
+			if seen is None:
+				yield from items
+			else:
+				for item in items:
+					item_key = self.key(item)
+					if item_key not in seen:
+						seen.add(item_key)
+						yield item
+			
+			if cursor is None and template in self.ctx._cursor_paths:
+				return
+
+class BulkResult:
+	"""
+	Per-item results of a bulk operation, keyed by object ID.
+	Items that succeeded are in results, and items that raised an exception are in errors.
+	"""
+	def __init__(self):
+		self.results: Dict[UUID, Any] = {}
+		self.errors: Dict[UUID, Exception] = {}
+	def ok(self) -> bool:
+		"""
+		Return True if no item failed.
+		"""
+		return not self.errors
+	def raise_first(self):
+		"""
+		Raise the first error, if any item failed.
+		"""
+		for error in self.errors.values():
+			raise error
+
+def fan_out(func: Callable[[SubtextObj], Any], objs: Iterable[SubtextObj], *, max_workers: int = 8) -> BulkResult:
+	"""
+	Call func for each object with bounded concurrency, collecting the results by object ID.
+	"""
+	from concurrent.futures import ThreadPoolExecutor
+	
+	def call(obj):
+		try:
+			return obj.id, func(obj), None
+		except Exception as e:
+			return obj.id, None, e
+	
+	result = BulkResult()
+	with ThreadPoolExecutor(max_workers=max_workers) as executor:
+		for id, value, error in executor.map(call, objs):
+			if error is not None:
+				result.errors[id] = error
+			else:
+				result.results[id] = value
+	return result
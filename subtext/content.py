@@ -4,10 +4,38 @@ subtext.content
 """
 import hashlib
 import struct
+import zlib
 
 from uuid import UUID
+from datetime import datetime, timedelta, timezone
 
-from typing import Optional
+from typing import Optional, Dict, Type, Iterable, List, Callable, Tuple, TYPE_CHECKING
+
+from .common import as_utc
+
+if TYPE_CHECKING:
+	from .blobstore import BlobStore
+
+_CODECS: Dict[str, Type['Content']] = {}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def register_content(*types: str) -> Callable[[Type['Content']], Type['Content']]:
+	"""
+	Class decorator that registers a Content subclass as the codec for the given message types.
+	Registering a type that is already registered replaces the previous codec.
+	"""
+	def decorator(cls: Type['Content']) -> Type['Content']:
+		for type in types:
+			_CODECS[type] = cls
+		return cls
+	return decorator
+
+def get_codec(type: str) -> Type['Content']:
+	"""
+	Return the Content subclass registered for the given message type, or FallbackContent.
+	"""
+	return _CODECS.get(type, FallbackContent)
 
 class Content:
 	"""
@@ -15,6 +43,16 @@ class Content:
 	"""
 	def __init__(self):
 		pass
+	@classmethod
+	def decode(cls, data: bytes) -> 'Content':
+		"""
+		Construct content from raw bytes.
+		Subclasses should override this to build the object directly; the default implementation
+		creates a blank instance and calls from_bytes.
+		"""
+		content = cls.__new__(cls)
+		content.from_bytes(data)
+		return content
 	def from_bytes(self, data: bytes):
 		"""
 		Deserialize content from raw bytes.
@@ -37,17 +75,24 @@ class FallbackContent(Content):
 	"""
 	def __init__(self, *, data: Optional[bytes] = None):
 		self.data = data
+	@classmethod
+	def decode(cls, data: bytes) -> 'FallbackContent':
+		return cls(data=data)
 	def from_bytes(self, data: bytes):
 		self.data = data
 	def to_bytes(self) -> bytes:
 		return self.data
 
+@register_content("Message", "TextMessage")
 class TextContent(Content):
 	"""
 	Text encoded in UTF-8 format.
 	"""
 	def __init__(self, *, text: Optional[str] = None):
 		self.text = text
+	@classmethod
+	def decode(cls, data: bytes) -> 'TextContent':
+		return cls(text=data.decode('utf-8'))
 	def from_bytes(self, data: bytes):
 		self.text = data.decode('utf-8')
 	def to_bytes(self) -> bytes:
@@ -55,15 +100,46 @@ class TextContent(Content):
 	def canon_type(self) -> Optional[str]:
 		return "TextMessage"
 
+@register_content("FileMessage")
 class FileContent(Content):
 	"""
 	Simple file container.
 	"""
-	def __init__(self, *, name: Optional[str] = None, type: Optional[str] = None, data: Optional[bytes] = None):
+	def __init__(self, *, name: Optional[str] = None, type: Optional[str] = None, data: Optional[bytes] = None, digest: Optional[bytes] = None):
+		"""
+		If the SHA-256 digest of data is already known, it can be given to avoid hashing the data again.
+		"""
 		self.name = name
 		self.type = type
 		self.data = data
-	def to_bytes(self) -> bytes:
+		
+		# Cached (data, digest) and (data, name, type, header), reused while data is the same object
+		self._digest = (data, digest) if digest is not None else None
+		self._header = None
+	@classmethod
+	def from_blob(cls, store: 'BlobStore', digest: bytes, *, name: str, type: str) -> Optional['FileContent']:
+		"""
+		Get file content from a blob store, without hashing it. Returns None if the blob is not stored.
+		"""
+		data = store.get(digest)
+		if data is None:
+			return None
+		return cls(name=name, type=type, data=data, digest=digest)
+	def digest(self) -> bytes:
+		"""
+		Get the SHA-256 digest of the data. It is computed once, until data is replaced.
+		"""
+		if self._digest is None or self._digest[0] is not self.data:
+			self._digest = (self.data, hashlib.sha256(self.data).digest())
+		return self._digest[1]
+	def header(self) -> bytes:
+		"""
+		Get the serialized header, including the data offset.
+		"""
+		cached = self._header
+		if cached is not None and cached[0] is self.data and cached[1] == self.name and cached[2] == self.type:
+			return cached[3]
+		
 		header = bytearray()
 		
 		# Name
@@ -78,71 +154,263 @@ class FileContent(Content):
 		header.extend(struct.pack('>i', len(self.data)))
 		
 		# Hash
-		sha256 = hashlib.sha256()
-		sha256.update(self.data)
-		header.extend(sha256.digest())
-		
-		# Data offset, header, data
-		return struct.pack('>i', len(header) + 4) + header + self.data
-	def from_bytes(self, data: bytes):
-		(data_offset,) = struct.unpack('>i', data[:4])
-		print("data_offset: 0x{:08x}".format(data_offset))
+		header.extend(self.digest())
 		
-		self.data = data[data_offset:]
-		
-		header = bytearray(data[4:data_offset])
+		# Data offset, header
+		header = struct.pack('>i', len(header) + 4) + header
+		self._header = (self.data, self.name, self.type, header)
+		return header
+	def to_bytes(self) -> bytes:
+		return self.header() + self.data
+	@staticmethod
+	def read_header(data: bytes) -> Tuple[str, str, int, bytes, int]:
+		"""
+		Parse only the header of serialized file content, without reading or verifying the data.
+		Returns the name, type, size, SHA-256 digest and data offset.
+		"""
+		try:
+			(data_offset,) = struct.unpack_from('>i', data, 0)
+			header = bytes(data[4:data_offset])
+			
+			name_end = header.index(0x00)
+			type_end = header.index(0x00, name_end + 1)
+			(size,) = struct.unpack_from('>i', header, type_end + 1)
+		except struct.error:
+			raise ValueError("Truncated file header") from None
 		
-		name_bytes = bytearray()
-		while True:
-			x = header.pop(0)
-			if x == 0x00:
-				break
-			name_bytes.append(x)
-		self.name = name_bytes.decode('utf-8')
+		return (
+			header[:name_end].decode('utf-8'),
+			header[name_end + 1:type_end].decode('utf-8'),
+			size,
+			header[type_end + 5:],
+			data_offset
+		)
+	@classmethod
+	def decode(cls, data: bytes) -> 'FileContent':
+		name, type, size, digest, data_offset = cls.read_header(data)
 		
-		type_bytes = bytearray()
-		while True:
-			x = header.pop(0)
-			if x == 0x00:
-				break
-			type_bytes.append(x)
-		self.type = type_bytes.decode('utf-8')
+		content = cls(name=name, type=type, data=bytes(data[data_offset:]))
 		
-		(size, ) = struct.unpack('>i', header[:4])
-		if size != len(self.data):
+		if size != len(content.data):
 			raise ValueError("Size mismatch")
-		
-		digest = bytes(header[4:])
-		sha256 = hashlib.sha256()
-		sha256.update(self.data)
-		if sha256.digest() != digest:
+		if content.digest() != digest:
 			raise ValueError("Hash mismatch")
+		
+		return content
+	def from_bytes(self, data: bytes):
+		content = self.decode(data)
+		self.name = content.name
+		self.type = content.type
+		self.data = content.data
+		self._digest = content._digest
+		self._header = None
 	def canon_type(self) -> Optional[str]:
 		return "FileMessage"
 
+@register_content("AddMember", "RemoveMember")
 class MemberContent(Content):
 	"""
 	Indicates that a member has been added or removed.
 	"""
 	def __init__(self, *, user_id: Optional[UUID] = None):
 		self.user_id = user_id
+	@classmethod
+	def decode(cls, data: bytes) -> 'MemberContent':
+		return cls(user_id=UUID(data.decode('utf-8')))
 	def to_bytes(self) -> bytes:
 		return str(self.user_id).encode('utf-8')
 	def from_bytes(self, data: bytes):
 		self.user_id = UUID(data.decode('utf-8'))
 
+class StructuredContent(Content):
+	"""
+	Base class for compact binary content that refers to another message.
+	
+	The encoding starts with a schema version byte and the 16-byte target message ID, followed by
+	type-specific fields packed with struct. Decoders accept any version up to their own.
+	"""
+	VERSION = 1
+	
+	_HEADER = struct.Struct('>B16s')
+	
+	def __init__(self, *, target_id: Optional[UUID] = None):
+		self.target_id = target_id
+	def _pack_header(self) -> bytes:
+		return self._HEADER.pack(self.VERSION, self.target_id.bytes)
+	@classmethod
+	def _unpack_header(cls, data: bytes):
+		(version, target) = cls._unpack(cls._HEADER, data, 0)
+		if version < 1 or version > cls.VERSION:
+			raise ValueError("Unsupported {} version {}".format(cls.__name__, version))
+		return version, UUID(bytes=target), cls._HEADER.size
+	@classmethod
+	def _unpack(cls, fields: struct.Struct, data: bytes, offset: int) -> tuple:
+		try:
+			return fields.unpack_from(data, offset)
+		except struct.error:
+			raise ValueError("Truncated {}".format(cls.__name__)) from None
+	def from_bytes(self, data: bytes):
+		self.__dict__.update(self.decode(data).__dict__)
+
+@register_content("Reaction")
+class ReactionContent(StructuredContent):
+	"""
+	Adds or removes a reaction to a message.
+	"""
+	_FIELDS = struct.Struct('>B')
+	
+	def __init__(self, *, target_id: Optional[UUID] = None, reaction: Optional[str] = None, remove: bool = False):
+		super().__init__(target_id=target_id)
+		self.reaction = reaction
+		self.remove = remove
+	def to_bytes(self) -> bytes:
+		return self._pack_header() + self._FIELDS.pack(1 if self.remove else 0) + self.reaction.encode('utf-8')
+	@classmethod
+	def decode(cls, data: bytes) -> 'ReactionContent':
+		_, target_id, offset = cls._unpack_header(data)
+		(flags,) = cls._unpack(cls._FIELDS, data, offset)
+		return cls(
+			target_id=target_id,
+			reaction=bytes(data[offset + cls._FIELDS.size:]).decode('utf-8'),
+			remove=bool(flags & 1)
+		)
+	def canon_type(self) -> Optional[str]:
+		return "Reaction"
+
+@register_content("ReadReceipt")
+class ReceiptContent(StructuredContent):
+	"""
+	Indicates that messages up to and including the target message have been read.
+	
+	read_time is stored in microseconds since the Unix epoch, and is decoded as a UTC datetime.
+	A naive read_time is taken to be UTC.
+	"""
+	_FIELDS = struct.Struct('>q')
+	
+	def __init__(self, *, target_id: Optional[UUID] = None, read_time: Optional[datetime] = None):
+		super().__init__(target_id=target_id)
+		self.read_time = read_time
+	def to_bytes(self) -> bytes:
+		micros = (as_utc(self.read_time) - _EPOCH) // timedelta(microseconds=1)
+		return self._pack_header() + self._FIELDS.pack(micros)
+	@classmethod
+	def decode(cls, data: bytes) -> 'ReceiptContent':
+		_, target_id, offset = cls._unpack_header(data)
+		(micros,) = cls._unpack(cls._FIELDS, data, offset)
+		return cls(
+			target_id=target_id,
+			read_time=_EPOCH + timedelta(microseconds=micros)
+		)
+	def canon_type(self) -> Optional[str]:
+		return "ReadReceipt"
+
+@register_content("EditMessage")
+class EditContent(StructuredContent):
+	"""
+	Replaces the text of the target message.
+	"""
+	def __init__(self, *, target_id: Optional[UUID] = None, text: Optional[str] = None):
+		super().__init__(target_id=target_id)
+		self.text = text
+	def to_bytes(self) -> bytes:
+		return self._pack_header() + self.text.encode('utf-8')
+	@classmethod
+	def decode(cls, data: bytes) -> 'EditContent':
+		_, target_id, offset = cls._unpack_header(data)
+		return cls(
+			target_id=target_id,
+			text=bytes(data[offset:]).decode('utf-8')
+		)
+	def canon_type(self) -> Optional[str]:
+		return "EditMessage"
+
+@register_content("DeleteMessage")
+class DeleteContent(StructuredContent):
+	"""
+	Marks the target message as deleted.
+	"""
+	def to_bytes(self) -> bytes:
+		return self._pack_header()
+	@classmethod
+	def decode(cls, data: bytes) -> 'DeleteContent':
+		_, target_id, _ = cls._unpack_header(data)
+		return cls(target_id=target_id)
+	def canon_type(self) -> Optional[str]:
+		return "DeleteMessage"
+
+@register_content("CompressedMessage")
+class CompressedContent(Content):
+	"""
+	Wraps other content, compressed with zlib.
+	
+	The encoding is the inner message type, a zero byte, then the compressed inner content. Use wrap()
+	to compress content only when that pays off. On encrypted boards, compress before encrypting.
+	"""
+	# Largest inner content decode() will inflate, so a small message can't exhaust memory
+	MAX_SIZE = 64 * 1024 * 1024
+	
+	def __init__(self, *, content: Optional[Content] = None, level: int = 6):
+		self.content = content
+		self.level = level
+		
+		# Encoding computed by wrap(), reused by to_bytes()
+		self._encoded = None
+	@classmethod
+	def wrap(cls, content: Content, *, level: int = 6, min_saving: float = 0.1) -> Content:
+		"""
+		Compress content if that makes it at least min_saving (a fraction) smaller, including the
+		wrapper's overhead. Otherwise, return the content unchanged.
+		"""
+		raw = content.to_bytes()
+		encoded = cls._encode(content, raw, level)
+		if len(encoded) > len(raw) * (1 - min_saving):
+			return content
+		wrapped = cls(content=content, level=level)
+		wrapped._encoded = (content, encoded)
+		return wrapped
+	@staticmethod
+	def _encode(content: Content, raw: bytes, level: int) -> bytes:
+		return (content.canon_type() or "").encode('utf-8') + b'\x00' + zlib.compress(raw, level)
+	def to_bytes(self) -> bytes:
+		if self._encoded is not None and self._encoded[0] is self.content:
+			return self._encoded[1]
+		return self._encode(self.content, self.content.to_bytes(), self.level)
+	@classmethod
+	def decode(cls, data: bytes) -> 'CompressedContent':
+		type_end = data.index(0x00)
+		type = bytes(data[:type_end]).decode('utf-8')
+		if type == "CompressedMessage":
+			raise ValueError("Nested compressed content")
+		
+		decompressor = zlib.decompressobj()
+		try:
+			raw = decompressor.decompress(data[type_end + 1:], cls.MAX_SIZE)
+		except zlib.error as e:
+			raise ValueError("Invalid compressed content: {}".format(e)) from e
+		if decompressor.unconsumed_tail:
+			raise ValueError("Compressed content is larger than {} bytes".format(cls.MAX_SIZE))
+		if not decompressor.eof:
+			raise ValueError("Truncated compressed content")
+		return cls(content=parse_content(type, raw))
+	def from_bytes(self, data: bytes):
+		self.content = self.decode(data).content
+		self._encoded = None
+	def canon_type(self) -> Optional[str]:
+		return "CompressedMessage"
+
 def parse_content(type: str, data: bytes) -> Content:
 	"""
 	Convert message data into a Content object based on the given type.
 	"""
-	if type == "Message" or type == "TextMessage":
-		content = TextContent()
-	elif type == "FileMessage":
-		content = FileContent()
-	elif type == "AddMember" or type == "RemoveMember":
-		content = MemberContent()
-	else:
-		content = FallbackContent()
-	
-	content.from_bytes(data)
-	return content
+	return _CODECS.get(type, FallbackContent).decode(data)
+
+def parse_many(messages: Iterable) -> List[Optional[Content]]:
+	"""
+	Convert a batch of messages (anything with type and content attributes, such as a page
+	from Board.get_messages) into Content objects. Messages without content map to None.
+	"""
+	codecs = _CODECS
+	return [
+		codecs.get(message.type, FallbackContent).decode(message.content) if message.content is not None else None
+		for message in messages
+	]
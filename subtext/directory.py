@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+subtext.directory
+"""
+from .common import Context
+from .board import Board, BoardEncryption
+from .user import User
+
+from uuid import UUID
+from bisect import bisect_left, insort
+import threading
+
+from typing import Optional, Union, List, Dict, Set, Tuple
+
+class BoardDirectory:
+	"""
+	Local index of the boards visible to the logged in user.
+	
+	sync() pages through the board list and only rebuilds boards whose lastUpdate changed. Lookups by
+	name prefix, owner, is_direct and encryption are answered from memory.
+	"""
+	def __init__(self, ctx: Context):
+		self.ctx = ctx
+		
+		self.boards: Dict[UUID, Board] = {}
+		self._versions: Dict[UUID, str] = {}
+		
+		self._names: List[Tuple[str, UUID]] = []
+		self._by_owner: Dict[UUID, Set[UUID]] = {}
+		self._by_encryption: Dict[BoardEncryption, Set[UUID]] = {}
+		self._direct: Set[UUID] = set()
+		
+		self._lock = threading.RLock()
+	
+	def sync(self, *, page_size: Optional[int] = None) -> Tuple[int, int, int]:
+		"""
+		Bring the index up to date with the server.
+		Returns the number of boards added, updated and removed.
+		"""
+		added = updated = 0
+		seen = set()
+		for data in Board._list_data(self.ctx, page_size=page_size):
+			board_id = UUID(data['id'])
+			seen.add(board_id)
+			if self._versions.get(board_id, None) == data['lastUpdate']:
+				continue
+			
+			board = Board._from_data(data, self.ctx)
+			with self._lock:
+				if board_id in self.boards:
+					self._remove(board_id)
+					updated += 1
+				else:
+					added += 1
+				self._add(board)
+				self._versions[board_id] = data['lastUpdate']
+		
+		with self._lock:
+			removed = [board_id for board_id in self.boards if board_id not in seen]
+			for board_id in removed:
+				self._remove(board_id)
+		
+		return added, updated, len(removed)
+	
+	def _add(self, board: Board):
+		self.boards[board.id] = board
+		insort(self._names, ((board.name or "").casefold(), board.id))
+		if board.owner is not None:
+			self._by_owner.setdefault(board.owner.id, set()).add(board.id)
+		if board.encryption is not None:
+			self._by_encryption.setdefault(board.encryption, set()).add(board.id)
+		if board.is_direct:
+			self._direct.add(board.id)
+	
+	def _remove(self, board_id: UUID):
+		board = self.boards.pop(board_id)
+		self._versions.pop(board_id, None)
+		key = ((board.name or "").casefold(), board_id)
+		i = bisect_left(self._names, key)
+		if i < len(self._names) and self._names[i] == key:
+			del self._names[i]
+		if board.owner is not None:
+			self._by_owner.get(board.owner.id, set()).discard(board_id)
+		if board.encryption is not None:
+			self._by_encryption.get(board.encryption, set()).discard(board_id)
+		self._direct.discard(board_id)
+	
+	def get(self, board_id: UUID) -> Optional[Board]:
+		"""
+		Get an indexed board by ID.
+		"""
+		return self.boards.get(board_id, None)
+	
+	def by_name(self, name: str) -> List[Board]:
+		"""
+		Get the boards with the given name (case-insensitive).
+		"""
+		return [board for board in self.find(prefix=name) if (board.name or "").casefold() == name.casefold()]
+	
+	def find(self, *,
+		prefix: Optional[str] = None,
+		owner: Optional[Union[User, UUID]] = None,
+		is_direct: Optional[bool] = None,
+		encryption: Optional[BoardEncryption] = None
+	) -> List[Board]:
+		"""
+		Find indexed boards matching all of the given criteria. Name prefixes are case-insensitive.
+		Results are sorted by name.
+		"""
+		with self._lock:
+			candidates = None
+			if owner is not None:
+				candidates = self._by_owner.get(owner.id if isinstance(owner, User) else owner, set())
+			if encryption is not None:
+				matches = self._by_encryption.get(encryption, set())
+				candidates = matches if candidates is None else candidates & matches
+			if is_direct:
+				candidates = self._direct if candidates is None else candidates & self._direct
+			
+			if prefix is not None:
+				prefix = prefix.casefold()
+				i = bisect_left(self._names, (prefix,))
+				ids = []
+				while i < len(self._names) and self._names[i][0].startswith(prefix):
+					ids.append(self._names[i][1])
+					i += 1
+			else:
+				ids = [board_id for _, board_id in self._names]
+			
+			return [
+				self.boards[board_id] for board_id in ids
+				if (candidates is None or board_id in candidates) and (is_direct is not False or board_id not in self._direct)
+			]
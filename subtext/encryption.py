@@ -3,19 +3,206 @@
 subtext.encryption
 """
 import gnupg, subprocess
+import hashlib
+import os
+import re
+import threading
+
+from collections import OrderedDict
+from uuid import UUID
 
 from .user import User
 
 from typing import Optional, List, Tuple, Union
 
+class DecryptCache:
+	"""
+	Bounded cache of decrypt results, keyed by message ID, a hash of the ciphertext and the keyring
+	generation, so trust verdicts are not reused after keys or trust levels change.
+	
+	Entries are held in an in-memory LRU. If disk_dir is given, entries evicted from memory
+	(and entries written by previous processes) are kept on disk, up to max_disk_entries, encrypted
+	with a passphrase using GnuPG's symmetric mode, so plaintext never touches the disk. Only files
+	the cache wrote are read or removed, so disk_dir may be shared.
+	"""
+	_DISK_NAME = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}-[0-9a-f]{64}$")
+	
+	def __init__(self, max_entries: int = 1024, *,
+		disk_dir: Optional[str] = None,
+		disk_passphrase: Optional[str] = None,
+		max_disk_entries: int = 16384
+	):
+		if disk_dir is not None and not disk_passphrase:
+			raise ValueError("An on-disk decrypt cache requires a passphrase")
+		
+		self.max_entries = max_entries
+		self.max_disk_entries = max_disk_entries
+		self.disk_dir = disk_dir
+		self._disk_passphrase = disk_passphrase
+		
+		self._entries = OrderedDict()
+		# Keys of the entries on disk, least recently used first
+		self._disk = OrderedDict()
+		self._lock = threading.Lock()
+		
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		
+		if disk_dir is not None:
+			os.makedirs(disk_dir, mode=0o700, exist_ok=True)
+			found = []
+			for entry in os.scandir(disk_dir):
+				if self._DISK_NAME.match(entry.name) and entry.is_file(follow_symlinks=False):
+					found.append((entry.stat().st_mtime_ns, entry.name))
+			for _, name in sorted(found):
+				self._disk[name] = None
+			self._evict_disk()
+	
+	@staticmethod
+	def _key(message_id: UUID, data: bytes, generation: str) -> str:
+		# Two updates, so the ciphertext isn't copied to append the generation
+		digest = hashlib.sha256(data)
+		digest.update(generation.encode('utf-8'))
+		return "{}-{}".format(message_id, digest.hexdigest())
+	
+	def _disk_path(self, key: str) -> str:
+		return os.path.join(self.disk_dir, key)
+	
+	def get(self, gpg: gnupg.GPG, message_id: UUID, data: bytes, *, generation: str = "") -> Optional[Tuple[bytes, bool]]:
+		"""
+		Look up a decrypt result, or return None if it is not cached.
+		"""
+		key = self._key(message_id, data, generation)
+		with self._lock:
+			if key in self._entries:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return self._entries[key]
+			on_disk = key in self._disk
+			if on_disk:
+				self._disk.move_to_end(key)
+		
+		if on_disk:
+			try:
+				with open(self._disk_path(key), 'rb') as f:
+					ciphertext = f.read()
+			except OSError:
+				ciphertext = None
+			crypt = gpg.decrypt(ciphertext, passphrase=self._disk_passphrase) if ciphertext is not None else None
+			if crypt is not None and crypt.ok and len(crypt.data) >= 1:
+				result = (crypt.data[1:], crypt.data[0] == 1)
+				with self._lock:
+					self.disk_hits += 1
+				self._put_memory(gpg, key, result)
+				return result
+		
+		with self._lock:
+			self.misses += 1
+		return None
+	
+	def put(self, gpg: gnupg.GPG, message_id: UUID, data: bytes, result: Tuple[bytes, bool], *, generation: str = ""):
+		"""
+		Store a decrypt result.
+		"""
+		self._put_memory(gpg, self._key(message_id, data, generation), result)
+	
+	def _put_memory(self, gpg: gnupg.GPG, key: str, result: Tuple[bytes, bool]):
+		evicted = []
+		with self._lock:
+			self._entries[key] = result
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				evicted.append(self._entries.popitem(last=False))
+		
+		for key, result in evicted:
+			if self.disk_dir is not None and key not in self._disk:
+				self._put_disk(gpg, key, result)
+	
+	def _put_disk(self, gpg: gnupg.GPG, key: str, result: Tuple[bytes, bool]):
+		crypt = gpg.encrypt(
+			bytes([1 if result[1] else 0]) + result[0],
+			None,
+			symmetric=True,
+			passphrase=self._disk_passphrase,
+			armor=False
+		)
+		if not crypt.ok:
+			return
+		# Unique per thread, so concurrent evictions of the same entry don't share a temp file
+		tmp_path = "{}.{}.{}.tmp".format(self._disk_path(key), os.getpid(), threading.get_ident())
+		try:
+			with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+				f.write(crypt.data)
+			os.replace(tmp_path, self._disk_path(key))
+		except OSError:
+			# The disk tier is best effort, and must never fail a decrypt
+			try:
+				os.remove(tmp_path)
+			except OSError:
+				pass
+			return
+		with self._lock:
+			self._disk[key] = None
+			self._disk.move_to_end(key)
+		self._evict_disk()
+	
+	def _evict_disk(self):
+		while True:
+			with self._lock:
+				if len(self._disk) <= self.max_disk_entries:
+					return
+				key, _ = self._disk.popitem(last=False)
+			try:
+				os.remove(self._disk_path(key))
+			except OSError:
+				pass
+	
+	def clear(self, *, disk: bool = True):
+		"""
+		Remove all cached entries, including those on disk unless disk is False.
+		"""
+		with self._lock:
+			self._entries.clear()
+			keys = list(self._disk) if disk else []
+			if disk:
+				self._disk.clear()
+		for key in keys:
+			try:
+				os.remove(self._disk_path(key))
+			except OSError:
+				pass
+	
+	def hit_rate(self) -> float:
+		"""
+		Return the fraction of lookups served from the cache (memory or disk).
+		"""
+		total = self.hits + self.disk_hits + self.misses
+		return (self.hits + self.disk_hits) / total if total else 0.0
+	
+	def stats(self) -> dict:
+		"""
+		Return cache metrics.
+		"""
+		return {
+			'entries': len(self._entries),
+			'disk_entries': len(self._disk),
+			'hits': self.hits,
+			'disk_hits': self.disk_hits,
+			'misses': self.misses,
+			'hit_rate': self.hit_rate()
+		}
+
 class Encryption:
 	"""
 	Provides encryption functionality for Subtext.
 	"""
-	def __init__(self, my_key: Optional[Union[User, str]] = None, *, gpg_dir: Optional[str] = None):
+	def __init__(self, my_key: Optional[Union[User, str]] = None, *, gpg_dir: Optional[str] = None, cache: Optional[DecryptCache] = None):
 		self.gpg = gnupg.GPG(use_agent=True, gnupghome=gpg_dir)
 		self.gpg.encoding = 'utf-8'
 		
+		self.cache = cache
+		
 		self.my_key = None
 		if my_key is not None:
 			self.change_my_key(my_key)
@@ -94,6 +281,7 @@ class Encryption:
 		to the owner's copy's fingerprint.
 		"""
 		subprocess.run(['gpg', '--batch', '--yes', '-u', self.my_key, '--sign-key', key_fp], check=False)
+		self._trust_changed()
 	
 	def trust_key_owner(self, key_fp: str, *, untrust: bool = False, full_trust: bool = False):
 		"""
@@ -115,6 +303,7 @@ class Encryption:
 			self.gpg.trust_keys([key_fp], 'TRUST_NEVER')
 		elif full_trust:
 			self.gpg.trust_keys([key_fp], 'TRUST_FULL')
+		self._trust_changed()
 	
 	def export_keys(self, keys: List[Union[User, str]]) -> bytes:
 		"""
@@ -145,6 +334,26 @@ class Encryption:
 		Import key data.
 		"""
 		self.gpg.import_keys(key_data)
+		self._trust_changed()
+	
+	def _keyring_generation(self) -> str:
+		# Changes whenever the keyring or trust database is modified, by this process or any other
+		home = self.gpg.gnupghome or os.environ.get('GNUPGHOME', None) or os.path.expanduser('~/.gnupg')
+		parts = []
+		# public-keys.d/pubring.db holds the keys when GnuPG 2.4+ uses keyboxd
+		for name in ('pubring.kbx', 'pubring.gpg', os.path.join('public-keys.d', 'pubring.db'), 'trustdb.gpg'):
+			try:
+				stat = os.stat(os.path.join(home, name))
+			except OSError:
+				continue
+			parts.append("{}:{}:{}".format(name, stat.st_mtime_ns, stat.st_size))
+		return ";".join(parts)
+	
+	def _trust_changed(self):
+		# Cached verdicts can no longer be hit (see _keyring_generation), so free the memory they use;
+		# entries on disk are left to age out, so they survive frequent key imports
+		if self.cache is not None:
+			self.cache.clear(disk=False)
 	
 	def encrypt(self,
 		data: bytes,
@@ -153,7 +362,8 @@ class Encryption:
 		compress: bool = False
 	) -> bytes:
 		"""
-		Encrypt and sign some data.
+		Encrypt and sign some data. GnuPG's own compression is off unless compress is set; to compress
+		message content, wrap it in a CompressedContent before encrypting.
 		"""
 		recipient_keys = []
 		for x in recipients:
@@ -173,10 +383,49 @@ class Encryption:
 		return crypt.data
 	
 	def decrypt(self,
-		data: bytes
+		data: bytes,
+		*,
+		message_id: Optional[UUID] = None
 	) -> Tuple[bytes, bool]:
 		"""
-		Decrypt and verify some data.
+		Decrypt and verify some data. If it cannot be decrypted, the result is unverified and usually
+		empty; use try_decrypt to tell that apart from empty plaintext.
+		If a message ID is given and this instance has a DecryptCache, the result is cached until the
+		keyring or trust database changes.
+		"""
+		result, _ = self._decrypt(data, message_id)
+		return result
+	def try_decrypt(self,
+		data: bytes,
+		*,
+		message_id: Optional[UUID] = None
+	) -> Optional[Tuple[bytes, bool]]:
+		"""
+		Like decrypt, but return None if the data cannot be decrypted.
 		"""
+		result, ok = self._decrypt(data, message_id)
+		return result if ok else None
+	def _decrypt(self, data: bytes, message_id: Optional[UUID]) -> Tuple[Tuple[bytes, bool], bool]:
+		if self.cache is not None and message_id is not None:
+			generation = self._keyring_generation()
+			result = self.cache.get(self.gpg, message_id, data, generation=generation)
+			if result is not None:
+				return result, True
+		
 		crypt = self.gpg.decrypt(data)
-		return (crypt.data, crypt.trust_level is not None and crypt.trust_level >= crypt.TRUST_FULLY)
+		result = (crypt.data, crypt.trust_level is not None and crypt.trust_level >= crypt.TRUST_FULLY)
+		
+		if self.cache is not None and message_id is not None and crypt.ok:
+			self.cache.put(self.gpg, message_id, data, result, generation=generation)
+		
+		return result, crypt.ok
+		
+		crypt = self.gpg.decrypt(data)
+		if not crypt.ok:
+			raise ValueError("Could not decrypt: {}".format(crypt.status))
+		result = (crypt.data, crypt.trust_level is not None and crypt.trust_level >= crypt.TRUST_FULLY)
+		
+		if self.cache is not None and message_id is not None:
+			self.cache.put(self.gpg, message_id, data, result, generation=generation)
+		
+		return result
@@ -2,10 +2,7 @@
 """
 subtext.error
 """
-import iso8601 as _iso8601
 import re as _re
-import inspect as _inspect
-import sys as _sys
 
 # https://stackoverflow.com/a/1176023 - camelCase to snake_case
 _RE_SNAKE_CASE = _re.compile(r'(?<!^)(?=[A-Z])')
@@ -53,7 +50,8 @@ class UserLocked(APIError):
 	def __init__(self, message: str, status_code: int, **data):
 		super().__init__(message, status_code, **data)
 		if 'lock_expiry' in self.__dict__:
-			self.lock_expiry = _iso8601.parse_date(self.lock_expiry)
+			import iso8601
+			self.lock_expiry = iso8601.parse_date(self.lock_expiry)
 
 class SessionExpired(APIError):
 	"""
@@ -120,13 +118,15 @@ class NotFriends(APIError):
 	You are not friends with this user.
 	"""
 
+# Error name to class, built on first use
+_ERRORS = None
+
 def api_error(message: str, status_code: int, **data) -> APIError:
 	"""
 	Construct an APIError or one of its subclasses.
 	"""
+	global _ERRORS
+	if _ERRORS is None:
+		_ERRORS = {name: obj for name, obj in globals().items() if isinstance(obj, type) and issubclass(obj, APIError)}
 	
-	for name, obj in _inspect.getmembers(_sys.modules[__name__], _inspect.isclass):
-		if message == name and issubclass(obj, APIError):
-			return obj(message, status_code, **data)
-	
-	return APIError(message, status_code, **data)
+	return _ERRORS.get(message, APIError)(message, status_code, **data)
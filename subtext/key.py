@@ -2,11 +2,10 @@
 """
 subtext.key
 """
-from .common import Context, SubtextObj
+from .common import Context, SubtextObj, parse_date
 
 from uuid import UUID
 from datetime import datetime
-import iso8601
 import json
 
 from typing import Optional
@@ -21,11 +20,14 @@ class Key(SubtextObj):
 		
 		self.data = None
 	def refresh(self):
-		resp = self.ctx.get("/Subtext/key/{}".format(self.id))
+		resp, validator = self.ctx.get_conditional("/Subtext/key/{}".format(self.id), self._validator)
+		if resp is None:
+			return
+		self._validator = validator
 		
 		self.data = resp.content
 		
 		if 'X-Metadata' in resp.headers:
 			metadata = json.loads(resp.headers['X-Metadata'])
 			
-			self.publish_time = iso8601.parse_date(metadata['publishTime'])
+			self.publish_time = parse_date(metadata['publishTime'])
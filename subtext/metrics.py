@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+subtext.metrics - Request metrics collection, with Prometheus text export.
+"""
+import threading
+
+from bisect import bisect_left
+
+from .common import RequestHook
+from .error import APIError
+
+from typing import Dict, Tuple, Sequence, Optional
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+	"""
+	Cumulative histogram of observed values, in the style of a Prometheus histogram.
+	"""
+	def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+		self.buckets = tuple(sorted(buckets))
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+	def observe(self, value: float):
+		"""
+		Record a value.
+		"""
+		self.counts[bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+	def cumulative(self):
+		"""
+		Return (upper bound, cumulative count) pairs, ending with the +Inf bucket.
+		"""
+		total = 0
+		result = []
+		for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+			total += count
+			result.append((bound, total))
+		return result
+
+class EndpointStats:
+	"""
+	Counters and latency histogram for one endpoint.
+	"""
+	def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+		self.requests = 0
+		self.errors = 0
+		self.bytes_sent = 0
+		self.bytes_received = 0
+		self.status_codes: Dict[int, int] = {}
+		self.latency = Histogram(buckets)
+
+class MetricsCollector(RequestHook):
+	"""
+	Collects per-endpoint request counts, error counts, bytes transferred, status codes and latency
+	histograms. Register it with Context.add_hook.
+	"""
+	def __init__(self, *, buckets: Sequence[float] = DEFAULT_BUCKETS, prefix: str = "subtext_client"):
+		self.buckets = buckets
+		self.prefix = prefix
+		self.endpoints: Dict[Tuple[str, str], EndpointStats] = {}
+		self._lock = threading.Lock()
+	def _stats(self, method: str, path: str) -> EndpointStats:
+		key = (method, path)
+		stats = self.endpoints.get(key, None)
+		if stats is None:
+			stats = self.endpoints.setdefault(key, EndpointStats(self.buckets))
+		return stats
+	def after_response(self, method: str, path: str, status_code: int, latency: float, bytes_sent: int, bytes_received: int):
+		with self._lock:
+			stats = self._stats(method, path)
+			stats.requests += 1
+			stats.bytes_sent += bytes_sent
+			stats.bytes_received += bytes_received
+			stats.status_codes[status_code] = stats.status_codes.get(status_code, 0) + 1
+			stats.latency.observe(latency)
+	def on_error(self, method: str, path: str, error: Exception, latency: float):
+		with self._lock:
+			stats = self._stats(method, path)
+			stats.errors += 1
+			if not isinstance(error, APIError):
+				# Transport errors never reach after_response
+				stats.requests += 1
+				stats.latency.observe(latency)
+	def reset(self):
+		"""
+		Discard all collected metrics.
+		"""
+		with self._lock:
+			self.endpoints = {}
+	def total_requests(self, path: Optional[str] = None) -> int:
+		"""
+		Return the number of requests sent, optionally only to the given path template.
+		"""
+		with self._lock:
+			return sum(stats.requests for (_, x), stats in self.endpoints.items() if path is None or x == path)
+	def to_prometheus(self) -> str:
+		"""
+		Export collected metrics in the Prometheus text exposition format.
+		"""
+		p = self.prefix
+		lines = [
+			"# HELP {}_requests_total Requests sent.".format(p),
+			"# TYPE {}_requests_total counter".format(p)
+		]
+		with self._lock:
+			endpoints = sorted(self.endpoints.items())
+			for (method, path), stats in endpoints:
+				lines.append('{}_requests_total{{{}}} {}'.format(p, _labels(method, path), stats.requests))
+			
+			lines.append("# HELP {}_errors_total Requests that failed.".format(p))
+			lines.append("# TYPE {}_errors_total counter".format(p))
+			for (method, path), stats in endpoints:
+				lines.append('{}_errors_total{{{}}} {}'.format(p, _labels(method, path), stats.errors))
+			
+			lines.append("# HELP {}_responses_total Responses received, by status code.".format(p))
+			lines.append("# TYPE {}_responses_total counter".format(p))
+			for (method, path), stats in endpoints:
+				for status_code, count in sorted(stats.status_codes.items()):
+					lines.append('{}_responses_total{{{},status="{}"}} {}'.format(p, _labels(method, path), status_code, count))
+			
+			for name, attr, help in (("sent", 'bytes_sent', "Request body bytes sent."), ("received", 'bytes_received', "Response body bytes received.")):
+				lines.append("# HELP {}_bytes_{}_total {}".format(p, name, help))
+				lines.append("# TYPE {}_bytes_{}_total counter".format(p, name))
+				for (method, path), stats in endpoints:
+					lines.append('{}_bytes_{}_total{{{}}} {}'.format(p, name, _labels(method, path), getattr(stats, attr)))
+			
+			lines.append("# HELP {}_request_duration_seconds Request latency.".format(p))
+			lines.append("# TYPE {}_request_duration_seconds histogram".format(p))
+			for (method, path), stats in endpoints:
+				labels = _labels(method, path)
+				for bound, count in stats.latency.cumulative():
+					lines.append('{}_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(p, labels, "+Inf" if bound == float('inf') else repr(float(bound)), count))
+				lines.append('{}_request_duration_seconds_sum{{{}}} {}'.format(p, labels, repr(stats.latency.sum)))
+				lines.append('{}_request_duration_seconds_count{{{}}} {}'.format(p, labels, stats.latency.count))
+		
+		return "\n".join(lines) + "\n"
+
+def _labels(method: str, path: str) -> str:
+	return 'method="{}",path="{}"'.format(method, path.replace('\\', '\\\\').replace('"', '\\"'))
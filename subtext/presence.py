@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+subtext.presence
+"""
+from .common import Context, BulkResult, fan_out
+from .user import User, UserPresence
+
+from uuid import UUID
+from datetime import datetime
+import copy
+import heapq
+import threading
+import time
+
+from typing import Optional, Union, Iterable, List, Dict, Callable
+
+class PresenceTracker:
+	"""
+	Keeps an in-memory presence table for a set of watched users.
+	
+	refresh() updates the stalest entries in concurrent batches. Calls to set_presence are coalesced:
+	only the latest presence is sent, once coalesce_delay seconds have passed since the first call.
+	
+	Failures in the background (a coalesced update, or a refresh started by start()) are counted in
+	errors, kept in last_error and passed to on_error. An update that fails stays pending, and is sent
+	again by the next flush.
+	"""
+	def __init__(self, ctx: Context, *,
+		max_age: float = 30.0,
+		batch_size: int = 64,
+		max_workers: int = 8,
+		coalesce_delay: float = 0.25
+	):
+		self.ctx = ctx
+		self.max_age = max_age
+		self.batch_size = batch_size
+		self.max_workers = max_workers
+		self.coalesce_delay = coalesce_delay
+		
+		self.users: Dict[UUID, User] = {}
+		self._checked: Dict[UUID, float] = {}
+		self._lock = threading.Lock()
+		
+		self._pending = None
+		self._timer = None
+		
+		self.errors = 0
+		self.last_error: Optional[Exception] = None
+		# Called with the exception when a background update or refresh fails
+		self.on_error: Optional[Callable[[Exception], None]] = None
+		
+		self._thread = None
+		self._stop = threading.Event()
+	
+	def watch(self, users: Iterable[Union[User, UUID]]):
+		"""
+		Start tracking the given users. Their presence is unknown until the next refresh.
+		"""
+		with self._lock:
+			for x in users:
+				user_id = x.id if isinstance(x, User) else x
+				if user_id not in self.users:
+					self.users[user_id] = User(user_id, self.ctx)
+					self._checked[user_id] = 0.0
+	
+	def unwatch(self, users: Iterable[Union[User, UUID]]):
+		"""
+		Stop tracking the given users.
+		"""
+		with self._lock:
+			for x in users:
+				user_id = x.id if isinstance(x, User) else x
+				self.users.pop(user_id, None)
+				self._checked.pop(user_id, None)
+	
+	def presence(self, user: Union[User, UUID]) -> Optional[UserPresence]:
+		"""
+		Get a watched user's last known presence.
+		"""
+		user = self.users.get(user.id if isinstance(user, User) else user, None)
+		return user.presence if user is not None else None
+	
+	def last_active(self, user: Union[User, UUID]) -> Optional[datetime]:
+		"""
+		Get a watched user's last known activity time.
+		"""
+		user = self.users.get(user.id if isinstance(user, User) else user, None)
+		return user.last_active if user is not None else None
+	
+	def stale_count(self) -> int:
+		"""
+		Return the number of entries older than max_age.
+		"""
+		cutoff = time.monotonic() - self.max_age
+		with self._lock:
+			return sum(1 for checked in self._checked.values() if checked <= cutoff)
+	
+	def refresh(self, *, limit: Optional[int] = None) -> BulkResult:
+		"""
+		Refresh up to limit (by default, batch_size) entries older than max_age, stalest first.
+		"""
+		cutoff = time.monotonic() - self.max_age
+		with self._lock:
+			stale = [(checked, user_id) for user_id, checked in self._checked.items() if checked <= cutoff]
+			batch = [self.users[user_id] for _, user_id in heapq.nsmallest(limit or self.batch_size, stale)]
+		return self._refresh_batch(batch)
+	
+	def _refresh_batch(self, batch: List[User]) -> BulkResult:
+		# Refresh copies, so readers never see a half-updated entry
+		result = fan_out(self._fetch, batch, max_workers=self.max_workers)
+		
+		now = time.monotonic()
+		with self._lock:
+			for user_id, user in result.results.items():
+				if user_id in self.users:
+					self.users[user_id] = user
+					self._checked[user_id] = now
+		return result
+	
+	def _fetch(self, user: User) -> User:
+		# Keeps the validator, so unchanged users cost a 304
+		fresh = copy.copy(user)
+		fresh.refresh()
+		return fresh
+	
+	def refresh_all(self) -> BulkResult:
+		"""
+		Refresh every entry that is stale when called, in batches, stalest first. Each entry is refreshed
+		at most once, even if a sweep takes longer than max_age.
+		"""
+		cutoff = time.monotonic() - self.max_age
+		with self._lock:
+			stale = [user_id for _, user_id in sorted((checked, user_id) for user_id, checked in self._checked.items() if checked <= cutoff)]
+		
+		total = BulkResult()
+		for i in range(0, len(stale), self.batch_size):
+			with self._lock:
+				batch = [self.users[user_id] for user_id in stale[i:i + self.batch_size] if user_id in self.users]
+			result = self._refresh_batch(batch)
+			total.results.update(result.results)
+			total.errors.update(result.errors)
+		return total
+	
+	def start(self, interval: float = 1.0):
+		"""
+		Refresh stale entries in a background thread, every interval seconds.
+		"""
+		if self._thread is not None:
+			return
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+		self._thread.start()
+	
+	def stop(self):
+		"""
+		Stop the background thread and send any pending presence update.
+		"""
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+		self.flush()
+	
+	def _run(self, interval: float):
+		while not self._stop.is_set():
+			try:
+				result = self.refresh_all()
+			except Exception as e:
+				self._record_error(e)
+			else:
+				for e in result.errors.values():
+					self._record_error(e)
+			self._stop.wait(interval)
+	
+	def _record_error(self, e: Exception):
+		with self._lock:
+			self.errors += 1
+			self.last_error = e
+		if self.on_error is not None:
+			try:
+				self.on_error(e)
+			except Exception:
+				# Must not kill the background thread
+				pass
+	
+	def set_presence(self, presence: UserPresence, until_time: Optional[datetime] = None, other_data: Optional[str] = None):
+		"""
+		Set the logged in user's presence. Rapid successive calls are coalesced into one update.
+		"""
+		with self._lock:
+			self._pending = (presence, until_time, other_data)
+			if self._timer is None:
+				self._timer = threading.Timer(self.coalesce_delay, self._flush_later)
+				self._timer.daemon = True
+				self._timer.start()
+	
+	def flush(self):
+		"""
+		Send the pending presence update now, if there is one. If it fails, it stays pending, unless a
+		newer one was set meanwhile, and the exception is raised.
+		"""
+		with self._lock:
+			pending = self._pending
+			self._pending = None
+			if self._timer is not None:
+				self._timer.cancel()
+				self._timer = None
+		if pending is None:
+			return
+		try:
+			User(self.ctx.user_id(), self.ctx).set_presence(*pending)
+		except Exception:
+			with self._lock:
+				if self._pending is None:
+					self._pending = pending
+			raise
+	def _flush_later(self):
+		try:
+			self.flush()
+		except Exception as e:
+			self._record_error(e)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+subtext.search - Local full-text index over synced message history, using SQLite FTS5.
+"""
+from .board import Board, BoardEncryption, Message
+from .user import User
+from .content import TextContent, FileContent, CompressedContent, get_codec, parse_content
+from .common import as_utc
+
+from uuid import UUID
+from datetime import datetime, timezone
+import sqlite3
+import struct
+import threading
+
+from typing import Optional, Union, List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+	from .encryption import Encryption
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+	rowid INTEGER PRIMARY KEY,
+	id TEXT NOT NULL UNIQUE,
+	board_id TEXT NOT NULL,
+	author_id TEXT,
+	timestamp REAL NOT NULL,
+	type TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_board_time ON messages (board_id, timestamp);
+CREATE INDEX IF NOT EXISTS messages_author_time ON messages (author_id, timestamp);
+CREATE VIRTUAL TABLE IF NOT EXISTS message_text USING fts5(body);
+CREATE TABLE IF NOT EXISTS sync_state (
+	board_id TEXT PRIMARY KEY,
+	last_timestamp TEXT NOT NULL
+);
+"""
+
+class SearchHit:
+	"""
+	A message matching a search query.
+	"""
+	def __init__(self, message_id: UUID, board_id: UUID, author_id: Optional[UUID], timestamp: datetime, type: Optional[str], rank: float):
+		self.message_id = message_id
+		self.board_id = board_id
+		self.author_id = author_id
+		self.timestamp = timestamp
+		self.type = type
+		self.rank = rank
+	def message(self, board: Board) -> Message:
+		"""
+		Get the matching message. (Call refresh on it to retrieve its content.)
+		"""
+		return Message(self.message_id, board.ctx, board=board, timestamp=self.timestamp, type=self.type,
+			author=User(self.author_id, board.ctx) if self.author_id else None
+		)
+
+class MessageIndex:
+	"""
+	Full-text index over message history, stored in a SQLite database (in memory by default).
+	
+	update() fetches only messages newer than the last indexed one for each board, so the index can be
+	kept current without reindexing. Text messages are indexed by their text, and file messages by
+	their name and type, including when wrapped in CompressedContent. If an Encryption is given,
+	messages on GnuPG boards are decrypted first.
+	"""
+	def __init__(self, path: str = ":memory:", *, encryption: Optional['Encryption'] = None):
+		self.path = path
+		self.encryption = encryption
+		
+		self._db = sqlite3.connect(path, check_same_thread=False)
+		self._lock = threading.Lock()
+		with self._lock, self._db:
+			self._db.executescript(_SCHEMA)
+	
+	def close(self):
+		"""
+		Close the underlying database.
+		"""
+		with self._lock:
+			self._db.close()
+	
+	def update(self, board: Board, *, page_size: Optional[int] = None) -> int:
+		"""
+		Index the board's messages that arrived since the last update. Returns the number indexed.
+		"""
+		board_key = str(board.id)
+		with self._lock:
+			row = self._db.execute("SELECT last_timestamp FROM sync_state WHERE board_id = ?", (board_key,)).fetchone()
+		since_time = datetime.fromisoformat(row[0]) if row else None
+		
+		count = 0
+		last_timestamp = since_time
+		for message in board.get_messages(since_time=since_time, page_size=page_size):
+			if self.add(message, board=board):
+				count += 1
+			if last_timestamp is None or message.timestamp > last_timestamp:
+				last_timestamp = message.timestamp
+		
+		if last_timestamp is not None:
+			with self._lock, self._db:
+				self._db.execute("INSERT OR REPLACE INTO sync_state (board_id, last_timestamp) VALUES (?, ?)",
+					(board_key, last_timestamp.isoformat())
+				)
+		return count
+	
+	def add(self, message: Message, *, board: Optional[Board] = None) -> bool:
+		"""
+		Index a single message. Returns False if it was already indexed or has no searchable text.
+		"""
+		board = board or message.board
+		with self._lock:
+			if self._db.execute("SELECT 1 FROM messages WHERE id = ?", (str(message.id),)).fetchone():
+				return False
+		
+		body = self._extract_text(message, board)
+		if not body:
+			return False
+		
+		with self._lock, self._db:
+			cursor = self._db.execute("INSERT OR IGNORE INTO messages (id, board_id, author_id, timestamp, type) VALUES (?, ?, ?, ?, ?)", (
+				str(message.id),
+				str(board.id),
+				str(message.author.id) if message.author else None,
+				message.timestamp.timestamp(),
+				message.type
+			))
+			if cursor.rowcount <= 0:
+				return False
+			self._db.execute("INSERT INTO message_text (rowid, body) VALUES (?, ?)", (cursor.lastrowid, body))
+		return True
+	
+	def _extract_text(self, message: Message, board: Board) -> Optional[str]:
+		codec = get_codec(message.type)
+		if codec is not TextContent and codec is not FileContent and codec is not CompressedContent:
+			return None
+		
+		if message.content is None:
+			message.refresh()
+		data = message.content
+		if data is None:
+			return None
+		
+		if board.encryption == BoardEncryption.gnupg:
+			if self.encryption is None:
+				return None
+			result = self.encryption.try_decrypt(data, message_id=message.id)
+			if result is None:
+				return None
+			data, _ = result
+		
+		try:
+			if codec is FileContent:
+				# Skips the payload
+				name, type, _, _, _ = FileContent.read_header(data)
+				return "{} {}".format(name, type)
+			content = parse_content(message.type, data)
+		except (ValueError, IndexError, UnicodeDecodeError, struct.error):
+			return None
+		if isinstance(content, CompressedContent):
+			content = content.content
+		if isinstance(content, TextContent):
+			return content.text
+		if isinstance(content, FileContent):
+			return "{} {}".format(content.name, content.type)
+		return None
+	
+	def remove(self, message_id: UUID):
+		"""
+		Remove a message from the index.
+		"""
+		with self._lock, self._db:
+			row = self._db.execute("SELECT rowid FROM messages WHERE id = ?", (str(message_id),)).fetchone()
+			if row:
+				self._db.execute("DELETE FROM message_text WHERE rowid = ?", row)
+				self._db.execute("DELETE FROM messages WHERE rowid = ?", row)
+	
+	def search(self, query: str, *,
+		board: Optional[Union[Board, UUID]] = None,
+		author: Optional[Union[User, UUID]] = None,
+		since_time: Optional[datetime] = None,
+		until_time: Optional[datetime] = None,
+		limit: int = 20
+	) -> List[SearchHit]:
+		"""
+		Search indexed messages, best matches first. The query uses SQLite FTS5 query syntax.
+		since_time and until_time are inclusive, and naive times are taken to be UTC.
+		"""
+		sql = [
+			"SELECT m.id, m.board_id, m.author_id, m.timestamp, m.type, bm25(message_text) AS rank",
+			"FROM message_text JOIN messages m ON m.rowid = message_text.rowid",
+			"WHERE message_text MATCH ?"
+		]
+		params = [query]
+		if board is not None:
+			sql.append("AND m.board_id = ?")
+			params.append(str(board.id if isinstance(board, Board) else board))
+		if author is not None:
+			sql.append("AND m.author_id = ?")
+			params.append(str(author.id if isinstance(author, User) else author))
+		if since_time is not None:
+			sql.append("AND m.timestamp >= ?")
+			params.append(as_utc(since_time).timestamp())
+		if until_time is not None:
+			sql.append("AND m.timestamp <= ?")
+			params.append(as_utc(until_time).timestamp())
+		sql.append("ORDER BY rank LIMIT ?")
+		params.append(limit)
+		
+		with self._lock:
+			rows = self._db.execute(" ".join(sql), params).fetchall()
+		return [SearchHit(
+			UUID(message_id),
+			UUID(board_id),
+			UUID(author_id) if author_id else None,
+			datetime.fromtimestamp(timestamp, timezone.utc),
+			type,
+			rank
+		) for message_id, board_id, author_id, timestamp, type, rank in rows]
@@ -0,0 +1,640 @@
+#!/usr/bin/env python3
+"""
+subtext.testing - In-process fake Subtext server, for tests and benchmarks.
+"""
+import json
+import base64
+import gzip
+import hashlib
+import re
+import threading
+import time
+
+from bisect import bisect_right
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from uuid import UUID, uuid4
+from datetime import datetime, timezone
+
+from typing import Optional, List, Dict, Iterable, Callable, Any
+
+_RE_UUID = r'([0-9a-fA-F-]{36})'
+
+_PRESENCES = ("Online", "Away", "Busy", "Offline")
+
+class _MockError(Exception):
+	def __init__(self, error: Optional[str], status_code: int, **data):
+		self.error = error
+		self.status_code = status_code
+		self.data = data
+
+class MockServer:
+	"""
+	A fake Subtext instance running on a local port in a background thread.
+	
+	latency is added to every request, in seconds. If bandwidth (bytes per second) is given, request
+	and response bodies are delayed as if sent over a link of that speed. default_page_size is used
+	for listing endpoints when the client does not give a count, and max_page_size caps the count the
+	client asks for. Use inject_error to make matching requests fail.
+	
+	If cursors is set, listings are ordered by key (ID, or timestamp and ID for messages) and return an
+	X-Next-Cursor header while more items follow; the cursor parameter resumes after it.
+	
+	Message and key content honours Range requests unless ranges is unset, responses are gzipped for
+	clients that accept it, and bytes_sent and bytes_received count body bytes as sent on the wire.
+	"""
+	def __init__(self, *,
+		instance_name: str = "mock",
+		latency: float = 0.0,
+		bandwidth: Optional[float] = None,
+		default_page_size: int = 50,
+		max_page_size: int = 1000,
+		cursors: bool = True,
+		ranges: bool = True,
+		host: str = "127.0.0.1",
+		port: int = 0
+	):
+		self.instance_name = instance_name
+		self.instance_id = uuid4()
+		self.latency = latency
+		self.bandwidth = bandwidth
+		self.default_page_size = default_page_size
+		self.max_page_size = max_page_size
+		self.cursors = cursors
+		self.ranges = ranges
+		
+		self.users = {}
+		self.boards = {}
+		self.keys = {}
+		self.sessions = {}
+		
+		self.request_count = 0
+		self.bytes_sent = 0
+		self.bytes_received = 0
+		
+		self._errors = []
+		self._lock = threading.RLock()
+		# Per-request state of handler threads
+		self._local = threading.local()
+		
+		handler = type('_Handler', (_MockHandler,), {'server_state': self})
+		self._httpd = ThreadingHTTPServer((host, port), handler)
+		self._httpd.daemon_threads = True
+		self._thread = None
+		
+		self._routes = [
+			('GET', r'/', self._root),
+			('GET', r'/Subtext', self._info),
+			('GET', r'/Subtext/user/queryidbyname', self._user_query_id),
+			('POST', r'/Subtext/user/create', self._user_create),
+			('POST', r'/Subtext/user/login', self._user_login),
+			('POST', r'/Subtext/user/heartbeat', self._user_heartbeat),
+			('POST', r'/Subtext/user/logout', self._user_logout),
+			('GET', r'/Subtext/user/{}'.format(_RE_UUID), self._user_get),
+			('GET', r'/Subtext/user/{}/friends'.format(_RE_UUID), self._user_list('friends')),
+			('DELETE', r'/Subtext/user/{}/friends/{}'.format(_RE_UUID, _RE_UUID), self._user_unfriend),
+			('GET', r'/Subtext/user/{}/blocked'.format(_RE_UUID), self._user_list('blocked')),
+			('POST', r'/Subtext/user/{}/blocked'.format(_RE_UUID), self._user_block),
+			('DELETE', r'/Subtext/user/{}/blocked/{}'.format(_RE_UUID, _RE_UUID), self._user_unblock),
+			('GET', r'/Subtext/user/{}/friendrequests'.format(_RE_UUID), self._user_list('friend_requests')),
+			('POST', r'/Subtext/user/{}/friendrequests'.format(_RE_UUID), self._user_send_friend_request),
+			('POST', r'/Subtext/user/{}/friendrequests/{}'.format(_RE_UUID, _RE_UUID), self._user_accept_friend_request),
+			('DELETE', r'/Subtext/user/{}/friendrequests/{}'.format(_RE_UUID, _RE_UUID), self._user_reject_friend_request),
+			('GET', r'/Subtext/user/{}/keys'.format(_RE_UUID), self._user_keys),
+			('POST', r'/Subtext/user/{}/keys'.format(_RE_UUID), self._user_add_key),
+			('PUT', r'/Subtext/user/{}/presence'.format(_RE_UUID), self._user_presence),
+			('GET', r'/Subtext/key/{}'.format(_RE_UUID), self._key_get),
+			('GET', r'/Subtext/board', self._board_list),
+			('POST', r'/Subtext/board/createdirect', self._board_create_direct),
+			('GET', r'/Subtext/board/{}'.format(_RE_UUID), self._board_get),
+			('GET', r'/Subtext/board/{}/members'.format(_RE_UUID), self._board_members),
+			('POST', r'/Subtext/board/{}/members'.format(_RE_UUID), self._board_add_member),
+			('DELETE', r'/Subtext/board/{}/members'.format(_RE_UUID), self._board_remove_member),
+			('GET', r'/Subtext/board/{}/messages'.format(_RE_UUID), self._board_messages),
+			('POST', r'/Subtext/board/{}/messages'.format(_RE_UUID), self._board_send_message),
+			('GET', r'/Subtext/board/{}/messages/{}'.format(_RE_UUID, _RE_UUID), self._board_message),
+		]
+		self._routes = [(method, re.compile(pattern + '$'), func) for method, pattern, func in self._routes]
+	
+	@property
+	def url(self) -> str:
+		"""
+		Base URL of this server.
+		"""
+		host, port = self._httpd.server_address[:2]
+		return "http://{}:{}".format(host, port)
+	
+	def start(self) -> 'MockServer':
+		"""
+		Start serving in a background thread.
+		"""
+		self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+		self._thread.start()
+		return self
+	
+	def stop(self):
+		"""
+		Stop serving.
+		"""
+		self._httpd.shutdown()
+		self._httpd.server_close()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+	
+	def __enter__(self) -> 'MockServer':
+		return self.start()
+	
+	def __exit__(self, *exc):
+		self.stop()
+	
+	# Seeding
+	
+	def add_user(self, name: str, password: str = "password", *, presence: str = "Offline", status: Optional[str] = None) -> UUID:
+		"""
+		Create a user and return their ID.
+		"""
+		with self._lock:
+			user_id = uuid4()
+			self.users[user_id] = {
+				'name': name,
+				'password': password,
+				'presence': presence,
+				'lastActive': _now(),
+				'status': status,
+				'isDeleted': False,
+				'friends': [],
+				'blocked': [],
+				'friend_requests': [],
+				'keys': []
+			}
+			return user_id
+	
+	def add_key(self, user_id: UUID, data: bytes) -> UUID:
+		"""
+		Publish a key for a user and return its ID.
+		"""
+		with self._lock:
+			key_id = uuid4()
+			self.keys[key_id] = {'data': data, 'publishTime': _now()}
+			self.users[user_id]['keys'].append(key_id)
+			return key_id
+	
+	def add_board(self, name: str, owner_id: UUID, members: Iterable[UUID] = (), *, encryption: str = "None", is_direct: bool = False) -> UUID:
+		"""
+		Create a board and return its ID. The owner is always a member.
+		"""
+		with self._lock:
+			board_id = uuid4()
+			member_list = [owner_id]
+			member_list.extend(x for x in members if x != owner_id)
+			self.boards[board_id] = {
+				'name': name,
+				'ownerId': owner_id,
+				'encryption': encryption,
+				'lastUpdate': _now(),
+				'lastSignificantUpdate': _now(),
+				'isDirect': is_direct,
+				'members': member_list,
+				'messages': [],
+				'message_index': {}
+			}
+			return board_id
+	
+	def add_message(self, board_id: UUID, author_id: Optional[UUID], content: bytes, *,
+		type: str = "Message",
+		is_system: bool = False,
+		timestamp: Optional[datetime] = None
+	) -> UUID:
+		"""
+		Post a message to a board and return its ID.
+		"""
+		with self._lock:
+			board = self.boards[board_id]
+			message_id = uuid4()
+			message = {
+				'id': message_id,
+				'timestamp': timestamp or _now(),
+				'authorId': author_id,
+				'isSystem': is_system,
+				'type': type,
+				'content': content
+			}
+			message['key'] = (message['timestamp'].isoformat(timespec='microseconds'), str(message_id))
+			board['message_index'][message_id] = message
+			board['messages'].append(message)
+			board['lastUpdate'] = message['timestamp']
+			if is_system:
+				board['lastSignificantUpdate'] = message['timestamp']
+			return message_id
+	
+	def inject_error(self, path: str, error: Optional[str] = "InvalidRequest", status_code: int = 400, *,
+		method: Optional[str] = None,
+		times: Optional[int] = 1,
+		**data
+	):
+		"""
+		Make requests whose path matches the given regular expression fail with an API error.
+		If times is None, the error is injected until clear_errors is called.
+		"""
+		with self._lock:
+			self._errors.append({
+				'method': method,
+				'path': re.compile(path),
+				'error': error,
+				'status_code': status_code,
+				'times': times,
+				'data': data
+			})
+	
+	def clear_errors(self):
+		"""
+		Remove all injected errors.
+		"""
+		with self._lock:
+			self._errors.clear()
+	
+	# Dispatch
+	
+	def _dispatch(self, method: str, path: str, params: Dict[str, str], body: bytes):
+		with self._lock:
+			self.request_count += 1
+			for rule in self._errors:
+				if (rule['method'] is None or rule['method'] == method) and rule['path'].search(path):
+					if rule['times'] is not None:
+						rule['times'] -= 1
+						if rule['times'] <= 0:
+							self._errors.remove(rule)
+					raise _MockError(rule['error'], rule['status_code'], **rule['data'])
+		
+		for route_method, pattern, func in self._routes:
+			if route_method != method:
+				continue
+			match = pattern.match(path)
+			if match:
+				with self._lock:
+					return func(params, body, *[UUID(x) for x in match.groups()])
+		raise _MockError(None, 404)
+	
+	def _session(self, params: Dict[str, str]) -> UUID:
+		try:
+			session_id = UUID(params.get('sessionId', ''))
+		except ValueError:
+			raise _MockError("InvalidRequest", 400)
+		if session_id not in self.sessions:
+			raise _MockError("SessionExpired", 401)
+		return self.sessions[session_id]
+	
+	def _user(self, user_id: UUID) -> dict:
+		if user_id not in self.users:
+			raise _MockError("NoObjectWithId", 404, id=str(user_id))
+		return self.users[user_id]
+	
+	def _board(self, board_id: UUID, user_id: UUID) -> dict:
+		if board_id not in self.boards:
+			raise _MockError("NoObjectWithId", 404, id=str(board_id))
+		board = self.boards[board_id]
+		if user_id not in board['members']:
+			raise _MockError("NotAuthorized", 403)
+		return board
+	
+	def _page(self, items: List, params: Dict[str, str], key: Callable[[Any], tuple] = lambda x: (str(x),)) -> List:
+		count = min(int(params['count']) if params.get('count', None) else self.default_page_size, self.max_page_size)
+		if not self.cursors:
+			start = int(params.get('start', 0) or 0)
+			return items[start:start + count]
+		
+		# Keyset pagination: items are ordered by key, and a cursor is the key of the last item returned
+		keys = sorted((key(x), i) for i, x in enumerate(items))
+		items = [items[i] for _, i in keys]
+		if params.get('cursor', None):
+			start = bisect_right(keys, (tuple(json.loads(params['cursor'])), len(items)))
+		else:
+			start = int(params.get('start', 0) or 0)
+		page = items[start:start + count]
+		if start + len(page) < len(items):
+			self._local.next_cursor = json.dumps(list(key(page[-1])))
+		return page
+	
+	# Handlers
+	
+	def _root(self, params, body):
+		return "Subtext"
+	
+	def _info(self, params, body):
+		return {'instanceName': self.instance_name, 'instanceId': str(self.instance_id)}
+	
+	def _user_query_id(self, params, body):
+		for user_id, user in self.users.items():
+			if user['name'] == params.get('name', None):
+				return str(user_id)
+		raise _MockError("NoObjectWithId", 404)
+	
+	def _user_create(self, params, body):
+		if any(user['name'] == params.get('name', None) for user in self.users.values()):
+			raise _MockError("NameTaken", 409)
+		return str(self.add_user(params['name'], params['password']))
+	
+	def _user_login(self, params, body):
+		user_id = UUID(params['userId'])
+		if self._user(user_id)['password'] != params.get('password', None):
+			raise _MockError("AuthError", 401)
+		session_id = uuid4()
+		self.sessions[session_id] = user_id
+		return str(session_id)
+	
+	def _user_heartbeat(self, params, body):
+		self._session(params)
+	
+	def _user_logout(self, params, body):
+		self._session(params)
+		self.sessions.pop(UUID(params['sessionId']))
+	
+	def _user_get(self, params, body, user_id):
+		self._session(params)
+		user = self._user(user_id)
+		return {
+			'name': user['name'],
+			'presence': user['presence'],
+			'lastActive': user['lastActive'].isoformat(),
+			'status': user['status'],
+			'isDeleted': user['isDeleted']
+		}
+	
+	def _user_list(self, field: str):
+		def handler(params, body, user_id):
+			self._session(params)
+			return [str(x) for x in self._page(self._user(user_id)[field], params)]
+		return handler
+	
+	def _user_unfriend(self, params, body, user_id, friend_id):
+		self._session(params)
+		if friend_id not in self._user(user_id)['friends']:
+			raise _MockError("NotFriends", 400)
+		self.users[user_id]['friends'].remove(friend_id)
+		self._user(friend_id)['friends'].remove(user_id)
+	
+	def _user_block(self, params, body, user_id):
+		self._session(params)
+		blocked_id = UUID(params['blockedId'])
+		if blocked_id in self._user(user_id)['blocked']:
+			raise _MockError("AlreadyBlocked", 400)
+		self.users[user_id]['blocked'].append(blocked_id)
+	
+	def _user_unblock(self, params, body, user_id, blocked_id):
+		self._session(params)
+		if blocked_id in self._user(user_id)['blocked']:
+			self.users[user_id]['blocked'].remove(blocked_id)
+	
+	def _user_send_friend_request(self, params, body, user_id):
+		sender_id = self._session(params)
+		user = self._user(user_id)
+		if sender_id in user['friends']:
+			raise _MockError("AlreadyFriends", 400)
+		if sender_id in user['friend_requests']:
+			raise _MockError("AlreadySent", 400)
+		user['friend_requests'].append(sender_id)
+	
+	def _user_accept_friend_request(self, params, body, user_id, sender_id):
+		self._session(params)
+		user = self._user(user_id)
+		if sender_id not in user['friend_requests']:
+			raise _MockError("NoObjectWithId", 404)
+		user['friend_requests'].remove(sender_id)
+		user['friends'].append(sender_id)
+		self._user(sender_id)['friends'].append(user_id)
+	
+	def _user_reject_friend_request(self, params, body, user_id, sender_id):
+		self._session(params)
+		if sender_id in self._user(user_id)['friend_requests']:
+			self.users[user_id]['friend_requests'].remove(sender_id)
+	
+	def _user_keys(self, params, body, user_id):
+		self._session(params)
+		return [
+			{'id': str(key_id), 'publishTime': self.keys[key_id]['publishTime'].isoformat()}
+			for key_id in self._page(self._user(user_id)['keys'], params)
+		]
+	
+	def _user_add_key(self, params, body, user_id):
+		if self._session(params) != user_id:
+			raise _MockError("NotAuthorized", 403)
+		return str(self.add_key(user_id, body))
+	
+	def _user_presence(self, params, body, user_id):
+		if self._session(params) != user_id:
+			raise _MockError("NotAuthorized", 403)
+		if params.get('presence', None) not in _PRESENCES:
+			raise _MockError("InvalidRequest", 400)
+		self.users[user_id]['presence'] = params['presence']
+		self.users[user_id]['lastActive'] = _now()
+	
+	def _key_get(self, params, body, key_id):
+		if key_id not in self.keys:
+			raise _MockError("NoObjectWithId", 404)
+		key = self.keys[key_id]
+		return _Raw(key['data'], {'publishTime': key['publishTime'].isoformat()})
+	
+	def _board_json(self, board_id: UUID, board: dict) -> dict:
+		return {
+			'id': str(board_id),
+			'name': board['name'],
+			'ownerId': str(board['ownerId']),
+			'encryption': board['encryption'],
+			'lastUpdate': board['lastUpdate'].isoformat(),
+			'lastSignificantUpdate': board['lastSignificantUpdate'].isoformat(),
+			'isDirect': board['isDirect']
+		}
+	
+	def _board_list(self, params, body):
+		user_id = self._session(params)
+		visible = [(board_id, board) for board_id, board in self.boards.items() if user_id in board['members']]
+		return [self._board_json(board_id, board) for board_id, board in self._page(visible, params, key=lambda x: (str(x[0]),))]
+	
+	def _board_create_direct(self, params, body):
+		user_id = self._session(params)
+		recipient_id = UUID(params['recipientId'])
+		self._user(recipient_id)
+		for board_id, board in self.boards.items():
+			if board['isDirect'] and set(board['members']) == {user_id, recipient_id}:
+				return str(board_id)
+		return str(self.add_board("", user_id, [recipient_id], is_direct=True))
+	
+	def _board_get(self, params, body, board_id):
+		board = self._board(board_id, self._session(params))
+		return self._board_json(board_id, board)
+	
+	def _board_members(self, params, body, board_id):
+		board = self._board(board_id, self._session(params))
+		return [str(x) for x in self._page(board['members'], params)]
+	
+	def _board_add_member(self, params, body, board_id):
+		user_id = self._session(params)
+		board = self._board(board_id, user_id)
+		member_id = UUID(params['userId'])
+		self._user(member_id)
+		if member_id in board['members']:
+			raise _MockError("AlreadyAdded", 400)
+		board['members'].append(member_id)
+		self.add_message(board_id, user_id, str(member_id).encode('utf-8'), type="AddMember", is_system=True)
+	
+	def _board_remove_member(self, params, body, board_id):
+		user_id = self._session(params)
+		board = self._board(board_id, user_id)
+		member_id = UUID(params['userId'])
+		if member_id in board['members']:
+			board['members'].remove(member_id)
+			self.add_message(board_id, user_id, str(member_id).encode('utf-8'), type="RemoveMember", is_system=True)
+	
+	def _board_messages(self, params, body, board_id):
+		board = self._board(board_id, self._session(params))
+		messages = board['messages']
+		if params.get('type', None):
+			messages = [x for x in messages if x['type'] == params['type']]
+		if params.get('onlySystem', 'false').lower() == 'true':
+			messages = [x for x in messages if x['isSystem']]
+		if params.get('sinceTime', None):
+			since_time = datetime.fromisoformat(params['sinceTime'])
+			messages = [x for x in messages if x['timestamp'] >= since_time]
+		return [{
+			'id': str(x['id']),
+			'timestamp': x['timestamp'].isoformat(),
+			'authorId': str(x['authorId']) if x['authorId'] else None,
+			'isSystem': x['isSystem'],
+			'type': x['type'],
+			'content': base64.b64encode(x['content']).decode('ascii') if x['content'] is not None else None
+		} for x in self._page(messages, params, key=lambda x: x['key'])]
+	
+	def _board_send_message(self, params, body, board_id):
+		user_id = self._session(params)
+		self._board(board_id, user_id)
+		return str(self.add_message(board_id, user_id, body,
+			type=params.get('type', None) or "Message",
+			is_system=params.get('isSystem', 'false').lower() == 'true'
+		))
+	
+	def _board_message(self, params, body, board_id, message_id):
+		board = self._board(board_id, self._session(params))
+		if message_id not in board['message_index']:
+			raise _MockError("NoObjectWithId", 404)
+		message = board['message_index'][message_id]
+		return _Raw(message['content'] or b'', {
+			'Timestamp': message['timestamp'].isoformat(),
+			'AuthorId': str(message['authorId']) if message['authorId'] else None,
+			'IsSystem': message['isSystem'],
+			'Type': message['type']
+		})
+
+class _Raw:
+	"""
+	A raw octet-stream response with an X-Metadata header.
+	"""
+	def __init__(self, data: bytes, metadata: dict):
+		self.data = data
+		self.metadata = metadata
+
+_RANGE = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+# Smallest response body compressed for clients that accept gzip
+_COMPRESS_MIN_SIZE = 256
+
+class _MockHandler(BaseHTTPRequestHandler):
+	server_state = None
+	protocol_version = "HTTP/1.1"
+	# Headers and body are written separately; with Nagle's algorithm and delayed ACKs, every request
+	# on a kept-alive connection would stall for ~40 ms
+	disable_nagle_algorithm = True
+	
+	def log_message(self, format, *args):
+		pass
+	
+	def _handle(self, method: str):
+		url = urlsplit(self.path)
+		params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+		length = int(self.headers.get('Content-Length', 0) or 0)
+		body = self.rfile.read(length) if length > 0 else b''
+		if self.headers.get('Content-Encoding', None) == 'gzip':
+			body = gzip.decompress(body)
+		
+		state = self.server_state
+		with state._lock:
+			state.bytes_received += length
+		if state.latency > 0:
+			time.sleep(state.latency)
+		if state.bandwidth:
+			time.sleep(length / state.bandwidth)
+		
+		headers = {}
+		state._local.next_cursor = None
+		try:
+			result = state._dispatch(method, url.path.rstrip('/') or '/', params, body)
+			status = 200
+			if isinstance(result, _Raw):
+				data = result.data
+				headers['Content-Type'] = 'application/octet-stream'
+				headers['X-Metadata'] = json.dumps(result.metadata)
+			elif isinstance(result, str) and url.path.rstrip('/') == '':
+				data = result.encode('utf-8')
+				headers['Content-Type'] = 'text/plain'
+			else:
+				data = json.dumps(result).encode('utf-8')
+				headers['Content-Type'] = 'application/json; charset=utf-8'
+		except _MockError as e:
+			status = e.status_code
+			if e.error is not None:
+				data = json.dumps(dict(e.data, error=e.error)).encode('utf-8')
+				headers['Content-Type'] = 'application/json; charset=utf-8'
+			else:
+				data = b''
+				headers['Content-Type'] = 'text/plain'
+		except Exception as e:
+			# A bug or unhandled input (e.g. a malformed timestamp): answer like a real server would
+			status = 500
+			data = "{}: {}".format(type(e).__name__, e).encode('utf-8')
+			headers['Content-Type'] = 'text/plain'
+		
+		if status == 200 and state._local.next_cursor is not None:
+			headers['X-Next-Cursor'] = state._local.next_cursor
+		if status == 200 and method == 'GET':
+			etag = '"{}"'.format(hashlib.sha1(data + headers.get('X-Metadata', '').encode('utf-8')).hexdigest())
+			headers['ETag'] = etag
+			if self.headers.get('If-None-Match', None) == etag:
+				status = 304
+				data = b''
+			elif isinstance(result, _Raw) and state.ranges and _RANGE.match(self.headers.get('Range', '')):
+				start, end = _RANGE.match(self.headers['Range']).groups()
+				start = int(start)
+				end = min(int(end), len(data) - 1) if end else len(data) - 1
+				if start < len(data):
+					status = 206
+					headers['Content-Range'] = "bytes {}-{}/{}".format(start, end, len(data))
+					data = data[start:end + 1]
+		
+		if status == 200 and len(data) >= _COMPRESS_MIN_SIZE and 'gzip' in self.headers.get('Accept-Encoding', ''):
+			data = gzip.compress(data, compresslevel=6)
+			headers['Content-Encoding'] = 'gzip'
+		
+		with state._lock:
+			state.bytes_sent += len(data)
+		if state.bandwidth:
+			time.sleep(len(data) / state.bandwidth)
+		self.send_response(status)
+		for key, value in headers.items():
+			self.send_header(key, value)
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+	
+	def do_GET(self):
+		self._handle('GET')
+	def do_POST(self):
+		self._handle('POST')
+	def do_PUT(self):
+		self._handle('PUT')
+	def do_PATCH(self):
+		self._handle('PATCH')
+	def do_DELETE(self):
+		self._handle('DELETE')
+
+def _now() -> datetime:
+	return datetime.now(timezone.utc)
@@ -2,11 +2,10 @@
 """
 subtext.user
 """
-from .common import Context, SubtextObj
+from .common import Context, SubtextObj, Pager, parse_date
 
 from uuid import UUID
 from datetime import datetime
-import iso8601
 
 from enum import Enum
 from typing import Optional
@@ -31,14 +30,18 @@ class User(SubtextObj):
 		
 		self.is_deleted = None
 	def refresh(self):
-		resp = self.ctx.get("/Subtext/user/{}".format(self.id), params={
+		resp, validator = self.ctx.get_conditional("/Subtext/user/{}".format(self.id), self._validator, params={
 			'sessionId': self.ctx.session_id()
-		}).json()
+		})
+		if resp is None:
+			return
+		self._validator = validator
+		resp = resp.json()
 		
 		self.name = resp.get('name', None)
 		
 		self.presence = UserPresence(resp['presence']) if resp.get('presence', None) else None
-		self.last_active = iso8601.parse_date(resp['lastActive']) if resp.get('lastActive', None) else None
+		self.last_active = parse_date(resp['lastActive']) if resp.get('lastActive', None) else None
 		self.status = resp.get('status', None)
 		
 		self.is_deleted = resp.get('isDeleted', None)
@@ -47,21 +50,10 @@ class User(SubtextObj):
 		"""
 		Retrieve this user's friends. (This is an iterator.)
 		"""
-		ids = set()
-		start = 0
-		while True:
-			resp = self.ctx.get("/Subtext/user/{}/friends".format(self.id), params={
-				'sessionId': self.ctx.session_id(),
-				'start': start,
-				'count': page_size
-			}).json()
-			start += len(resp)
-			if len(resp) <= 0:
-				break
-			for friend_id in resp:
-				if friend_id not in ids:
-					ids.add(friend_id)
-					yield User(UUID(friend_id), self.ctx)
+		for friend_id in Pager(self.ctx, "/Subtext/user/{}/friends".format(self.id), {
+			'sessionId': self.ctx.session_id()
+		}, page_size=page_size, key=str):
+			yield User(UUID(friend_id), self.ctx)
 	
 	def unfriend(self):
 		"""
@@ -75,21 +67,10 @@ class User(SubtextObj):
 		"""
 		Retrieve this user's blocked users. (This is an iterator.)
 		"""
-		ids = set()
-		start = 0
-		while True:
-			resp = self.ctx.get("/Subtext/user/{}/blocked".format(self.id), params={
-				'sessionId': self.ctx.session_id(),
-				'start': start,
-				'count': page_size
-			}).json()
-			start += len(resp)
-			if len(resp) <= 0:
-				break
-			for blocked_id in resp:
-				if blocked_id not in ids:
-					ids.add(blocked_id)
-					yield User(UUID(blocked_id), self.ctx)
+		for blocked_id in Pager(self.ctx, "/Subtext/user/{}/blocked".format(self.id), {
+			'sessionId': self.ctx.session_id()
+		}, page_size=page_size, key=str):
+			yield User(UUID(blocked_id), self.ctx)
 	
 	def block(self):
 		"""
@@ -112,21 +93,10 @@ class User(SubtextObj):
 		"""
 		Retrieve this user's friend requests. (This is an iterator.)
 		"""
-		ids = set()
-		start = 0
-		while True:
-			resp = self.ctx.get("/Subtext/user/{}/friendrequests".format(self.id), params={
-				'sessionId': self.ctx.session_id(),
-				'start': start,
-				'count': page_size
-			}).json()
-			start += len(resp)
-			if len(resp) <= 0:
-				break
-			for sender_id in resp:
-				if sender_id not in ids:
-					ids.add(sender_id)
-					yield User(UUID(sender_id), self.ctx)
+		for sender_id in Pager(self.ctx, "/Subtext/user/{}/friendrequests".format(self.id), {
+			'sessionId': self.ctx.session_id()
+		}, page_size=page_size, key=str):
+			yield User(UUID(sender_id), self.ctx)
 	
 	def send_friend_request(self):
 		"""
@@ -156,23 +126,12 @@ class User(SubtextObj):
 		"""
 		Retrieve this user's public keys. (This is an iterator.)
 		"""
-		ids = set()
-		start = 0
-		while True:
-			resp = self.ctx.get("/Subtext/user/{}/keys".format(self.id), params={
-				'sessionId': self.ctx.session_id(),
-				'start': start,
-				'count': page_size
-			}).json()
-			start += len(resp)
-			if len(resp) <= 0:
-				break
-			for key in resp:
-				if key['id'] not in ids:
-					ids.add(key['id'])
-					yield Key(UUID(key['id']), self.ctx,
-						publish_time=iso8601.parse_date(key['publishTime'])
-					)
+		for key in Pager(self.ctx, "/Subtext/user/{}/keys".format(self.id), {
+			'sessionId': self.ctx.session_id()
+		}, page_size=page_size, key=lambda key: key['id']):
+			yield Key(UUID(key['id']), self.ctx,
+				publish_time=parse_date(key['publishTime'])
+			)
 	
 	def add_key(self, data: bytes):
 		"""
@@ -188,7 +147,7 @@ class User(SubtextObj):
 		"""
 		self.ctx.put("/Subtext/user/{}/presence".format(self.id), params={
 			'sessionId': self.ctx.session_id(),
-			'presence': presence,
+			'presence': presence.value,
 			'untilTime': until_time,
 			'otherData': other_data
 		})
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+tests for subtext.blobstore, against subtext.testing.MockServer
+"""
+import hashlib
+import os
+import tempfile
+import unittest
+
+import subtext
+from subtext import content
+from subtext.blobstore import BlobStore
+from subtext.testing import MockServer
+
+class BlobStoreTest(unittest.TestCase):
+	def setUp(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.path = tmp.name
+	
+	def test_put_get(self):
+		store = BlobStore(self.path)
+		digest = store.put(b"hello")
+		self.assertEqual(digest, hashlib.sha256(b"hello").digest())
+		self.assertEqual(bytes(store.get(digest)), b"hello")
+		self.assertIsNone(store.get(hashlib.sha256(b"other").digest()))
+		self.assertEqual((store.hits, store.misses), (1, 1))
+	
+	def test_evicts_least_recently_used(self):
+		store = BlobStore(self.path, max_bytes=10)
+		a = store.put(b"a" * 4)
+		b = store.put(b"b" * 4)
+		store.get(a)
+		c = store.put(b"c" * 4)
+		self.assertIn(a, store)
+		self.assertNotIn(b, store)
+		self.assertIn(c, store)
+		self.assertEqual(store.total_bytes, 8)
+		self.assertEqual(sorted(os.listdir(self.path)), sorted([a.hex(), c.hex()]))
+	
+	def test_rebuilds_index(self):
+		store = BlobStore(self.path, max_bytes=10)
+		a = store.put(b"a" * 4)
+		b = store.put(b"b" * 4)
+		# Older than a, so evicted first after a restart
+		os.utime(os.path.join(self.path, b.hex()), (0, 0))
+		
+		store = BlobStore(self.path, max_bytes=10)
+		self.assertEqual(len(store), 2)
+		self.assertEqual(store.total_bytes, 8)
+		store.put(b"c" * 4)
+		self.assertIn(a, store)
+		self.assertNotIn(b, store)
+	
+	def test_file_removed(self):
+		# As when another thread evicts the blob between the index lookup and the open
+		store = BlobStore(self.path)
+		digest = store.put(b"hello")
+		os.remove(os.path.join(self.path, digest.hex()))
+		self.assertIsNone(store.get(digest))
+		self.assertEqual((len(store), store.total_bytes), (0, 0))
+		store.remove(digest)
+		store._forget(digest.hex())
+		self.assertEqual(store.total_bytes, 0)
+
+class RecordingBlobStore(BlobStore):
+	def __init__(self, path):
+		super().__init__(path)
+		self.returned = []
+	def get(self, digest):
+		blob = super().get(digest)
+		self.returned.append(blob)
+		return blob
+
+class RefreshTest(unittest.TestCase):
+	RANGES = True
+	
+	def setUp(self):
+		self.server = MockServer(ranges=self.RANGES).start()
+		self.addCleanup(self.server.stop)
+		user_id = self.server.add_user('test')
+		board_id = self.server.add_board('test', user_id, [])
+		self.data = os.urandom(64 * 1024)
+		self.encoded = content.FileContent(name="test.bin", type="application/octet-stream", data=self.data).to_bytes()
+		self.server.add_message(board_id, user_id, self.encoded, type="FileMessage")
+		
+		client = subtext.Client(self.server.url)
+		client.login('test', 'password')
+		self.message = client.get_board(board_id).tail(1)[0]
+		
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.store = RecordingBlobStore(tmp.name)
+		client.ctx.blob_store = self.store
+	
+	def refresh(self) -> int:
+		before = self.server.bytes_sent
+		self.message.content = None
+		self.message.refresh()
+		self.assertEqual(self.message.content, self.encoded)
+		return self.server.bytes_sent - before
+	
+	def test_refresh(self):
+		self.assertGreater(self.refresh(), len(self.data))
+		self.assertIn(hashlib.sha256(self.data).digest(), self.store)
+		# Only the header is downloaded when the server honours the range
+		sent = self.refresh()
+		if self.RANGES:
+			self.assertLess(sent, len(self.data))
+			self.assertEqual(self.store.hits, 1)
+			self.assertTrue(all(x.closed for x in self.store.returned if x is not None))
+		else:
+			self.assertGreater(sent, len(self.data))
+
+class FullResponseRefreshTest(RefreshTest):
+	RANGES = False
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+tests for subtext.board, against subtext.testing.MockServer
+"""
+import unittest
+
+from datetime import datetime, timedelta, timezone
+
+import subtext
+from subtext.board import Board
+from subtext.common import RequestHook
+from subtext.testing import MockServer
+
+class PathHook(RequestHook):
+	def __init__(self):
+		self.paths = []
+	def before_request(self, method, path):
+		self.paths.append((method, path))
+	def count(self, path):
+		return self.paths.count(('GET', path))
+
+class WindowedMessagesTest(unittest.TestCase):
+	MESSAGES = 500
+	
+	def setUp(self):
+		# Page sizes below are larger than the server's cap
+		self.server = MockServer(max_page_size=100).start()
+		self.addCleanup(self.server.stop)
+		user_id = self.server.add_user('test')
+		board_id = self.server.add_board('test', user_id, [])
+		start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+		self.message_ids = [
+			self.server.add_message(board_id, user_id, str(i).encode('ascii'), timestamp=start + timedelta(seconds=i))
+			for i in range(self.MESSAGES)
+		]
+		
+		client = subtext.Client(self.server.url)
+		client.login('test', 'password')
+		self.board = client.get_board(board_id)
+	
+	def test_tail_larger_than_server_page(self):
+		messages = self.board.tail(250)
+		self.assertEqual([x.id for x in messages], self.message_ids[-250:])
+	
+	def test_reverse_larger_than_server_page(self):
+		messages = list(self.board.get_messages(reverse=True, limit=5, page_size=300))
+		self.assertEqual([x.id for x in messages], self.message_ids[:-6:-1])
+	
+	def test_reverse_all(self):
+		messages = list(self.board.get_messages(reverse=True, page_size=300))
+		self.assertEqual([x.id for x in messages], self.message_ids[::-1])
+	
+	def test_before_larger_than_server_page(self):
+		before = self.board.tail(1)[0].timestamp
+		messages = self.board.tail(150, before=before)
+		self.assertEqual([x.id for x in messages], self.message_ids[-151:-1])
+	
+	def test_naive_times(self):
+		# Naive times are UTC
+		naive = datetime(2024, 1, 1, 0, 0, 10)
+		self.assertEqual([x.id for x in self.board.get_messages(until_time=naive)], self.message_ids[:11])
+		self.assertEqual([x.id for x in self.board.tail(2, before=naive)], self.message_ids[8:10])
+		self.assertEqual([x.id for x in self.board.get_messages(after=naive, limit=2)], self.message_ids[11:13])
+
+class AuthorFilterTest(unittest.TestCase):
+	def setUp(self):
+		# The mock ignores authorId, so the filter is applied client-side
+		self.server = MockServer().start()
+		self.addCleanup(self.server.stop)
+		user_id = self.server.add_user('test')
+		self.other_id = self.server.add_user('other')
+		board_id = self.server.add_board('test', user_id, [self.other_id])
+		start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+		self.first_id = self.server.add_message(board_id, self.other_id, b"first", timestamp=start)
+		for i in range(300):
+			self.server.add_message(board_id, user_id, b"filler", timestamp=start + timedelta(seconds=i + 1))
+		self.last_id = self.server.add_message(board_id, self.other_id, b"last", timestamp=start + timedelta(seconds=301))
+		
+		client = subtext.Client(self.server.url)
+		client.login('test', 'password')
+		self.board = client.get_board(board_id)
+	
+	def requests(self, **kwargs):
+		before = self.server.request_count
+		messages = list(self.board.get_messages(author=self.other_id, limit=1, **kwargs))
+		return [x.id for x in messages], self.server.request_count - before
+	
+	def test_forward(self):
+		ids, requests = self.requests(since_time=datetime(2024, 1, 1, 0, 0, 1))
+		self.assertEqual(ids, [self.last_id])
+		self.assertLess(requests, 10)
+	
+	def test_reverse(self):
+		ids, requests = self.requests(reverse=True, before=datetime(2024, 1, 1, 0, 5, 1))
+		self.assertEqual(ids, [self.first_id])
+		# Mostly locating the window; one request per message scanned would be over 300
+		self.assertLess(requests, 40)
+
+class MembershipTest(unittest.TestCase):
+	MEMBERS = "/Subtext/board/{id}/members"
+	
+	def setUp(self):
+		self.server = MockServer().start()
+		self.addCleanup(self.server.stop)
+		self.user_id = self.server.add_user('test')
+		self.other_id = self.server.add_user('other')
+		self.board_id = self.server.add_board('test', self.user_id, [])
+		
+		self.client = subtext.Client(self.server.url)
+		self.client.login('test', 'password')
+		self.hook = PathHook()
+		self.client.ctx.add_hook(self.hook)
+		self.other = subtext.User(self.other_id, self.client.ctx)
+	
+	def test_add_remove_readd(self):
+		board = self.client.get_board(self.board_id)
+		self.assertEqual(board.member_ids, {self.user_id})
+		walked = self.hook.count(self.MEMBERS)
+		
+		board.add_member(self.other)
+		board.refresh()
+		self.assertEqual(board.member_ids, {self.user_id, self.other_id})
+		board.remove_member(self.other)
+		board.refresh()
+		self.assertEqual(board.member_ids, {self.user_id})
+		board.add_member(self.other)
+		board.refresh()
+		self.assertEqual(board.member_ids, {self.user_id, self.other_id})
+		# Only the first sync walked the member list
+		self.assertEqual(self.hook.count(self.MEMBERS), walked)
+	
+	def test_resync_finds_drift(self):
+		board = self.client.get_board(self.board_id)
+		# Not announced by a member event, so only a snapshot sees it
+		self.server.boards[self.board_id]['members'].append(self.other_id)
+		
+		self.assertFalse(board.sync_members(resync_every=1))
+		self.assertFalse(board.is_member(self.other_id))
+		self.assertTrue(board.sync_members(resync_every=1))
+		self.assertTrue(board.is_member(self.other_id))
+		self.assertFalse(board.sync_members(resync_every=1))
+	
+	def test_refresh_skips_members(self):
+		board = self.client.get_board(self.board_id)
+		# Not a significant update
+		self.server.add_message(self.board_id, self.user_id, b"hello")
+		paths = len(self.hook.paths)
+		board.refresh()
+		self.assertEqual(self.hook.paths[paths:], [('GET', "/Subtext/board/{id}")])
+		self.assertEqual(board.member_ids, {self.user_id})
+	
+	def test_is_member_unsynced(self):
+		board = Board(self.board_id, self.client.ctx)
+		self.assertIsNone(board.member_ids)
+		self.assertTrue(board.is_member(self.user_id))
+		self.assertFalse(board.is_member(self.other))
+		walked = self.hook.count(self.MEMBERS)
+		
+		board.add_member(self.other)
+		board.sync_members()
+		self.assertTrue(board.is_member(self.other))
+		self.assertEqual(self.hook.count(self.MEMBERS), walked)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+tests for subtext.bot, against subtext.testing.MockServer
+"""
+import tempfile
+import threading
+import unittest
+
+from uuid import uuid4
+
+import subtext
+from subtext import content
+from subtext.bot import Dispatcher
+from subtext.encryption import Encryption
+from subtext.testing import MockServer
+
+class DispatchTest(unittest.TestCase):
+	def setUp(self):
+		self.server = MockServer().start()
+		self.addCleanup(self.server.stop)
+		self.user_id = self.server.add_user('test')
+		self.board_id = self.server.add_board('test', self.user_id, [])
+		
+		self.client = subtext.Client(self.server.url)
+		self.client.login('test', 'password')
+		self.dispatcher = Dispatcher(self.client.ctx, workers=1)
+	
+	def dispatch_last(self):
+		board = self.client.get_board(self.board_id)
+		self.dispatcher.dispatch(board, board.tail(1)[0])
+	
+	def test_malformed_content(self):
+		events = []
+		self.dispatcher.add_handler(events.append)
+		self.dispatcher.add_handler(events.append, "Reaction")
+		data = content.ReactionContent(target_id=uuid4(), reaction="x").to_bytes()
+		self.server.add_message(self.board_id, None, data[:-2], type="Reaction")
+		
+		self.dispatch_last()
+		self.assertEqual(len(events), 2)
+		self.assertIsNone(events[0].content)
+		self.assertEqual(self.dispatcher.decode_errors, 1)
+	
+	def test_stats_by_handler(self):
+		self.dispatcher.add_handler(lambda event: None)
+		self.dispatcher.add_handler(lambda event: 1 / 0)
+		self.server.add_message(self.board_id, None, b"hello")
+		
+		self.dispatch_last()
+		stats = list(self.dispatcher.stats.values())
+		self.assertEqual([x.calls for x in stats], [1, 1])
+		self.assertEqual([x.errors for x in stats], [0, 1])
+	
+	def test_on_error_fails(self):
+		def on_error(event, e):
+			raise RuntimeError()
+		self.dispatcher.on_error = on_error
+		self.dispatcher.add_handler(lambda event: 1 / 0)
+		self.dispatcher.add_handler(lambda event: None)
+		self.server.add_message(self.board_id, None, b"hello")
+		
+		self.dispatch_last()
+		stats = list(self.dispatcher.stats.values())
+		self.assertEqual([x.calls for x in stats], [1, 1])
+		self.assertEqual([x.errors for x in stats], [1, 0])
+		self.assertEqual(self.dispatcher.dispatch_errors, 1)
+	
+	def test_undecryptable(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.dispatcher.encryption = Encryption(gpg_dir=tmp.name)
+		board_id = self.server.add_board('encrypted', self.user_id, [], encryption="GnuPG")
+		self.server.add_message(board_id, None, b"not ciphertext")
+		events = []
+		self.dispatcher.add_handler(events.append)
+		
+		board = self.client.get_board(board_id)
+		self.dispatcher.dispatch(board, board.tail(1)[0])
+		self.assertEqual(len(events), 1)
+		self.assertIsNone(events[0].content)
+		self.assertFalse(events[0].verified)
+		self.assertEqual(self.dispatcher.decode_errors, 1)
+
+class FakeEncryption:
+	def __init__(self):
+		self.recipients = None
+	def encrypt(self, data, recipients):
+		self.recipients = recipients
+		return data
+
+class PollTest(unittest.TestCase):
+	MESSAGES = 20
+	
+	def setUp(self):
+		self.server = MockServer().start()
+		self.addCleanup(self.server.stop)
+		self.user_id = self.server.add_user('test')
+		self.board_id = self.server.add_board('test', self.user_id, [])
+		
+		self.client = subtext.Client(self.server.url)
+		self.client.login('test', 'password')
+	
+	def test_fetch_waits_for_queue(self):
+		dispatcher = Dispatcher(self.client.ctx, workers=1, queue_size=3, page_size=2)
+		dispatcher.watch([self.client.get_board(self.board_id)])
+		for i in range(self.MESSAGES):
+			self.server.add_message(self.board_id, None, str(i).encode('ascii'))
+		
+		counts = []
+		thread = threading.Thread(target=lambda: counts.append(dispatcher.poll()))
+		thread.start()
+		q = dispatcher._queues[0]
+		# Fetching stops while the queue is full, so the rest of the board is not loaded
+		thread.join(0.5)
+		self.assertTrue(thread.is_alive())
+		requests = self.server.request_count
+		thread.join(0.2)
+		self.assertEqual(self.server.request_count, requests)
+		
+		contents = [q.get(timeout=5)[1].content for _ in range(self.MESSAGES)]
+		thread.join()
+		self.assertEqual(counts, [self.MESSAGES])
+		self.assertEqual(contents, [str(i).encode('ascii') for i in range(self.MESSAGES)])
+	
+	def test_send_syncs_members(self):
+		self.server.add_board('encrypted', self.user_id, [], encryption="GnuPG")
+		encryption = FakeEncryption()
+		dispatcher = Dispatcher(self.client.ctx, encryption=encryption)
+		board = [x for x in self.client.get_boards() if x.name == 'encrypted'][0]
+		self.assertIsNone(board.member_ids)
+		
+		dispatcher.send(board, content.TextContent(text="hello"))
+		self.assertEqual([x.id for x in encryption.recipients], [self.user_id])
+
+if __name__ == "__main__":
+	unittest.main()
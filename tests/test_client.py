@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+tests for subtext.ClientManager, against subtext.testing.MockServer
+"""
+import unittest
+
+import subtext
+from subtext.testing import MockServer
+
+class ClientManagerTest(unittest.TestCase):
+	def setUp(self):
+		self.server = MockServer(instance_name="managed").start()
+		self.addCleanup(self.server.stop)
+		self.manager = subtext.ClientManager()
+		self.addCleanup(self.manager.close)
+	
+	def test_discovers_once(self):
+		self.assertEqual(self.manager.client(self.server.url).instance_name, "managed")
+		count = self.server.request_count
+		client = self.manager.client(self.server.url)
+		self.assertEqual((client.instance_name, client.instance_id), ("managed", self.server.instance_id))
+		self.assertEqual(self.server.request_count, count)
+	
+	def test_server_error_not_kept(self):
+		self.server.inject_error(r"^/Subtext$", None, 500)
+		with self.assertRaises(subtext.APIError):
+			self.manager.client(self.server.url)
+		self.assertEqual(self.manager.client(self.server.url).instance_name, "managed")
+	
+	def test_fallback_not_kept(self):
+		self.server.inject_error(r"^/Subtext$", "NoObjectWithId", 404)
+		self.assertIsNone(self.manager.client(self.server.url).instance_name)
+		self.assertEqual(self.manager.client(self.server.url).instance_name, "managed")
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+tests for subtext.common, against subtext.testing.MockServer
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from uuid import uuid4
+
+import subtext
+from subtext.common import Pager
+from subtext.testing import MockServer
+
+class DiscoveryCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.server = MockServer(instance_name="cached").start()
+		self.addCleanup(self.server.stop)
+		
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.path = os.path.join(tmp.name, "discovery.json")
+	
+	def discover(self):
+		client = subtext.Client(self.server.url, discovery_cache=self.path)
+		return client.instance_name, client.instance_id
+	
+	def test_cached(self):
+		self.assertEqual(self.discover(), ("cached", self.server.instance_id))
+		count = self.server.request_count
+		self.assertEqual(self.discover(), ("cached", self.server.instance_id))
+		self.assertEqual(self.server.request_count, count)
+	
+	def test_corrupt(self):
+		for data in (
+			{self.server.url: "garbage"},
+			{self.server.url: {'instanceName': "cached", 'instanceId': "not a uuid", 'time': time.time()}},
+			{self.server.url: {'instanceName': "cached", 'instanceId': None, 'time': "now"}},
+			[self.server.url],
+		):
+			with self.subTest(data=data):
+				with open(self.path, 'w') as f:
+					json.dump(data, f)
+				self.assertEqual(self.discover(), ("cached", self.server.instance_id))
+				with open(self.path, 'r') as f:
+					self.assertIsInstance(json.load(f)[self.server.url], dict)
+	
+	def test_server_error(self):
+		self.server.inject_error(r"^/Subtext$", None, 500)
+		with self.assertRaises(subtext.APIError):
+			self.discover()
+		self.assertFalse(os.path.exists(self.path))
+		self.assertEqual(self.discover(), ("cached", self.server.instance_id))
+	
+	def test_fallback_not_cached(self):
+		# A server without instance info
+		self.server.inject_error(r"^/Subtext$", "NoObjectWithId", 404, times=None)
+		self.assertEqual(self.discover(), (None, None))
+		self.assertFalse(os.path.exists(self.path))
+		
+		self.server.clear_errors()
+		self.assertEqual(self.discover(), ("cached", self.server.instance_id))
+
+class PagerTest(unittest.TestCase):
+	MEMBERS = 7
+	CURSORS = True
+	
+	def setUp(self):
+		self.server = MockServer(cursors=self.CURSORS).start()
+		self.addCleanup(self.server.stop)
+		user_id = self.server.add_user('test')
+		self.member_ids = [user_id] + [self.server.add_user('user{}'.format(i)) for i in range(self.MEMBERS - 1)]
+		self.board_id = self.server.add_board('test', user_id, self.member_ids)
+		
+		self.client = subtext.Client(self.server.url)
+		self.client.login('test', 'password')
+	
+	def pager(self, page_size: int, board_id=None) -> Pager:
+		return Pager(self.client.ctx, "/Subtext/board/{}/members".format(board_id or self.board_id), {
+			'sessionId': self.client.ctx.session_id()
+		}, page_size=page_size, key=str)
+	
+	def test_all_items(self):
+		pager = self.pager(3)
+		self.assertEqual(sorted(pager), sorted(str(x) for x in self.member_ids))
+		self.assertEqual(pager.pages, 3 if self.CURSORS else 4)
+	
+	def test_items_shift(self):
+		pager = self.pager(2)
+		items = iter(pager)
+		seen = [next(items), next(items)]
+		# Shifts every later item back by one
+		new_id = uuid4()
+		self.server.boards[self.board_id]['members'].insert(0, new_id)
+		seen.extend(items)
+		self.assertEqual(len(seen), len(set(seen)))
+		self.assertEqual(set(seen) - {str(new_id)}, {str(x) for x in self.member_ids})
+	
+	def test_single_page(self):
+		board_id = self.server.add_board('small', self.member_ids[0], [])
+		first = self.pager(3, board_id)
+		self.assertEqual(list(first), [str(self.member_ids[0])])
+		self.assertEqual(first.pages, 2)
+		
+		# Once the listing has returned a cursor, a page without one is known to be the last
+		list(self.pager(3))
+		second = self.pager(3, board_id)
+		self.assertEqual(list(second), [str(self.member_ids[0])])
+		self.assertEqual(second.pages, 1 if self.CURSORS else 2)
+
+class OffsetPagerTest(PagerTest):
+	CURSORS = False
+
+class SharedContextTest(unittest.TestCase):
+	THREADS = 64
+	CALLS = 4
+	
+	def setUp(self):
+		self.server = MockServer(default_page_size=10).start()
+		self.addCleanup(self.server.stop)
+		self.user_id = self.server.add_user('test')
+		self.board_id = self.server.add_board('test', self.user_id, [])
+		for i in range(25):
+			self.server.add_message(self.board_id, self.user_id, str(i).encode('ascii'))
+		
+		# Not yet discovered, so concurrent first use also races instance discovery
+		self.client = subtext.Client(self.server.url)
+		self.client.login('test', 'password')
+	
+	def work(self, i: int) -> bool:
+		if i % 4 == 0:
+			return self.client.instance_id == self.server.instance_id
+		elif i % 4 == 1:
+			return len(list(self.client.get_board(self.board_id).get_messages())) == 25
+		elif i % 4 == 2:
+			return self.client.get_user().name == 'test'
+		else:
+			self.client.heartbeat()
+			return True
+	
+	def test_threads(self):
+		results = []
+		barrier = threading.Barrier(self.THREADS)
+		def run(n):
+			barrier.wait()
+			for i in range(self.CALLS):
+				try:
+					results.append(self.work(n * self.CALLS + i))
+				except Exception as e:
+					results.append(e)
+		threads = [threading.Thread(target=run, args=(n,)) for n in range(self.THREADS)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(results, [True] * (self.THREADS * self.CALLS))
+
+if __name__ == "__main__":
+	unittest.main()
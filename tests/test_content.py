@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+tests for subtext.content
+"""
+import unittest
+import zlib
+
+from uuid import uuid4
+from datetime import datetime, timezone
+
+from subtext import content
+
+class StructuredContentTest(unittest.TestCase):
+	def setUp(self):
+		self.target_id = uuid4()
+	
+	def round_trip(self, value: content.Content) -> content.Content:
+		decoded = content.parse_content(value.canon_type(), value.to_bytes())
+		self.assertIs(type(decoded), type(value))
+		self.assertEqual(decoded.target_id, self.target_id)
+		return decoded
+	
+	def test_reaction(self):
+		for remove in (False, True):
+			decoded = self.round_trip(content.ReactionContent(target_id=self.target_id, reaction="\U0001F44D", remove=remove))
+			self.assertEqual(decoded.reaction, "\U0001F44D")
+			self.assertEqual(decoded.remove, remove)
+	
+	def test_receipt(self):
+		read_time = datetime(2024, 5, 6, 7, 8, 9, 123456, tzinfo=timezone.utc)
+		decoded = self.round_trip(content.ReceiptContent(target_id=self.target_id, read_time=read_time))
+		self.assertEqual(decoded.read_time, read_time)
+	
+	def test_receipt_naive(self):
+		# Naive times are UTC
+		decoded = self.round_trip(content.ReceiptContent(target_id=self.target_id, read_time=datetime(2024, 5, 6, 7, 8, 9)))
+		self.assertEqual(decoded.read_time, datetime(2024, 5, 6, 7, 8, 9, tzinfo=timezone.utc))
+	
+	def test_edit(self):
+		decoded = self.round_trip(content.EditContent(target_id=self.target_id, text="edited é"))
+		self.assertEqual(decoded.text, "edited é")
+	
+	def test_delete(self):
+		self.round_trip(content.DeleteContent(target_id=self.target_id))
+	
+	def test_truncated(self):
+		values = [
+			content.ReactionContent(target_id=self.target_id, reaction="x"),
+			content.ReceiptContent(target_id=self.target_id, read_time=datetime.now(timezone.utc)),
+			content.EditContent(target_id=self.target_id, text="x"),
+			content.DeleteContent(target_id=self.target_id)
+		]
+		for value in values:
+			data = value.to_bytes()
+			for length in (0, 1, 16):
+				with self.assertRaises(ValueError):
+					content.parse_content(value.canon_type(), data[:length])
+		with self.assertRaises(ValueError):
+			content.parse_content("ReadReceipt", values[1].to_bytes()[:-1])
+	
+	def test_unsupported_version(self):
+		data = content.StructuredContent._HEADER.pack(99, self.target_id.bytes)
+		with self.assertRaises(ValueError):
+			content.parse_content("DeleteMessage", data)
+
+class FileContentTest(unittest.TestCase):
+	def test_round_trip(self):
+		value = content.FileContent(name="a.txt", type="text/plain", data=b"hello")
+		decoded = content.parse_content("FileMessage", value.to_bytes())
+		self.assertEqual((decoded.name, decoded.type, decoded.data), ("a.txt", "text/plain", b"hello"))
+		self.assertEqual(content.FileContent.read_header(value.to_bytes())[:3], ("a.txt", "text/plain", 5))
+	
+	def test_truncated_header(self):
+		data = content.FileContent(name="a.txt", type="text/plain", data=b"hello").to_bytes()
+		for length in (0, 3, 12):
+			with self.assertRaises(ValueError):
+				content.FileContent.read_header(data[:length])
+
+class CompressedContentTest(unittest.TestCase):
+	def test_round_trip(self):
+		text = content.TextContent(text="hello " * 100)
+		wrapped = content.CompressedContent.wrap(text)
+		self.assertIsInstance(wrapped, content.CompressedContent)
+		decoded = content.parse_content("CompressedMessage", wrapped.to_bytes())
+		self.assertEqual(decoded.content.text, text.text)
+	
+	def test_size_cap(self):
+		data = b"TextMessage\x00" + zlib.compress(b"\x00" * (content.CompressedContent.MAX_SIZE + 1), 9)
+		self.assertLess(len(data), 100 * 1024)
+		with self.assertRaises(ValueError):
+			content.parse_content("CompressedMessage", data)
+	
+	def test_invalid(self):
+		nested = content.CompressedContent(content=content.CompressedContent(content=content.TextContent(text="x")))
+		for data in (b"TextMessage\x00garbage", b"TextMessage\x00" + zlib.compress(b"hello")[:-3], nested.to_bytes()):
+			with self.assertRaises(ValueError):
+				content.parse_content("CompressedMessage", data)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+tests for subtext.encryption
+"""
+import os
+import tempfile
+import unittest
+
+from uuid import uuid4
+
+from subtext.encryption import DecryptCache, Encryption
+
+class FakeCrypt:
+	def __init__(self, data: bytes):
+		self.data = data
+		self.ok = True
+
+class FakeGPG:
+	"""
+	Stands in for gnupg.GPG's symmetric mode.
+	"""
+	def encrypt(self, data, recipients, *, symmetric, passphrase, armor):
+		return FakeCrypt(passphrase.encode('utf-8') + data)
+	def decrypt(self, data, *, passphrase):
+		return FakeCrypt(data[len(passphrase):])
+
+class DecryptCacheTest(unittest.TestCase):
+	def setUp(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.dir = tmp.name
+		self.gpg = FakeGPG()
+	
+	def cache(self, **kwargs) -> DecryptCache:
+		return DecryptCache(2, disk_dir=self.dir, disk_passphrase="secret", **kwargs)
+	
+	def cache_files(self):
+		return sorted(x for x in os.listdir(self.dir) if x not in ("other", "subdir"))
+	
+	def test_disk_holds_evicted_entries(self):
+		cache = self.cache()
+		items = [(uuid4(), os.urandom(8)) for _ in range(3)]
+		for message_id, data in items:
+			cache.put(self.gpg, message_id, data, (data, True))
+		# Only the entry evicted from memory is written
+		self.assertEqual(len(self.cache_files()), 1)
+		
+		# A new process finds it on disk
+		message_id, data = items[0]
+		self.assertEqual(self.cache().get(self.gpg, message_id, data), (data, True))
+	
+	def test_disk_is_bounded(self):
+		cache = self.cache(max_disk_entries=3)
+		for _ in range(10):
+			data = os.urandom(8)
+			cache.put(self.gpg, uuid4(), data, (data, False))
+		self.assertEqual(len(self.cache_files()), 3)
+		self.assertEqual(cache.stats()['disk_entries'], 3)
+	
+	def test_clear_only_removes_own_files(self):
+		with open(os.path.join(self.dir, "other"), 'w') as f:
+			f.write("unrelated")
+		os.mkdir(os.path.join(self.dir, "subdir"))
+		
+		cache = self.cache()
+		for _ in range(4):
+			data = os.urandom(8)
+			cache.put(self.gpg, uuid4(), data, (data, False))
+		cache.clear(disk=False)
+		self.assertEqual(len(self.cache_files()), 2)
+		cache.clear()
+		self.assertEqual(self.cache_files(), [])
+		self.assertEqual(sorted(os.listdir(self.dir)), ["other", "subdir"])
+	
+	def test_disk_failure(self):
+		cache = self.cache()
+		os.rmdir(self.dir)
+		items = [(uuid4(), os.urandom(8)) for _ in range(3)]
+		for message_id, data in items:
+			cache.put(self.gpg, message_id, data, (data, True))
+		# Still served from memory
+		message_id, data = items[-1]
+		self.assertEqual(cache.get(self.gpg, message_id, data), (data, True))
+		self.assertEqual(cache.stats()['disk_entries'], 0)
+
+class KeyringGenerationTest(unittest.TestCase):
+	def setUp(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.dir = tmp.name
+		self.encryption = Encryption(gpg_dir=self.dir)
+	
+	def test_keyboxd(self):
+		# Written by keyboxd (GnuPG 2.4+) when another process imports a key
+		os.makedirs(os.path.join(self.dir, "public-keys.d"), exist_ok=True)
+		before = self.encryption._keyring_generation()
+		with open(os.path.join(self.dir, "public-keys.d", "pubring.db"), 'wb') as f:
+			f.write(b"keys")
+		self.assertNotEqual(self.encryption._keyring_generation(), before)
+
+class DecryptTest(unittest.TestCase):
+	def test_not_ciphertext(self):
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		encryption = Encryption(gpg_dir=tmp.name, cache=DecryptCache())
+		message_id = uuid4()
+		self.assertEqual(encryption.decrypt(b"not ciphertext", message_id=message_id), (b"", False))
+		self.assertIsNone(encryption.try_decrypt(b"not ciphertext", message_id=message_id))
+		# Failures aren't cached
+		self.assertEqual(encryption.cache.stats()['entries'], 0)
+
+if __name__ == "__main__":
+	unittest.main()
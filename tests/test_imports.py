@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+tests for the import-time cost of subtext
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+# Dependencies that must not be loaded by a bare "import subtext"
+LAZY_MODULES = ('requests', 'iso8601', 'gnupg', 'subtext.encryption', 'concurrent.futures')
+
+class ImportTest(unittest.TestCase):
+	def test_lazy_modules(self):
+		loaded = subprocess.run([sys.executable, '-c', 'import subtext, sys; print(" ".join(m for m in {!r} if m in sys.modules))'.format(LAZY_MODULES)],
+			cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), capture_output=True, text=True, check=True
+		).stdout.split()
+		self.assertEqual(loaded, [])
+	
+	def test_lazy_attrs(self):
+		import subtext
+		self.assertIs(subtext.Encryption, subtext.encryption.Encryption)
+		self.assertIs(subtext.BlobStore, subtext.blobstore.BlobStore)
+		self.assertIn('search', dir(subtext))
+		with self.assertRaises(AttributeError):
+			subtext.missing
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+tests for subtext.metrics, against subtext.testing.MockServer
+"""
+import unittest
+
+import requests
+
+import subtext
+from subtext.metrics import MetricsCollector
+from subtext.testing import MockServer
+
+USER = ('GET', "/Subtext/user/{id}")
+
+class CollectorTest(unittest.TestCase):
+	def setUp(self):
+		self.server = MockServer().start()
+		self.addCleanup(self.server.stop)
+		self.user_id = self.server.add_user('test')
+		
+		self.client = subtext.Client(self.server.url)
+		self.client.login('test', 'password')
+		self.metrics = MetricsCollector()
+		self.client.ctx.add_hook(self.metrics)
+	
+	def test_counts(self):
+		self.client.get_user()
+		self.client.get_user()
+		stats = self.metrics.endpoints[USER]
+		self.assertEqual(stats.requests, 2)
+		self.assertEqual(stats.errors, 0)
+		self.assertEqual(sum(stats.status_codes.values()), 2)
+		self.assertEqual(stats.latency.count, 2)
+		self.assertGreater(stats.bytes_received, 0)
+		self.assertEqual(self.metrics.total_requests(), 2)
+		self.assertEqual(self.metrics.total_requests("/Subtext/board"), 0)
+	
+	def test_api_error(self):
+		self.server.inject_error(r"^/Subtext/user/", "NoObjectWithId", 404)
+		with self.assertRaises(subtext.NoObjectWithId):
+			self.client.get_user()
+		stats = self.metrics.endpoints[USER]
+		self.assertEqual(stats.requests, 1)
+		self.assertEqual(stats.errors, 1)
+		self.assertEqual(stats.status_codes, {404: 1})
+	
+	def test_transport_error(self):
+		server = MockServer().start()
+		server.stop()
+		client = subtext.Client(server.url)
+		client.ctx.add_hook(self.metrics)
+		with self.assertRaises(requests.ConnectionError):
+			client.ctx.get("/Subtext/user/{}".format(self.user_id))
+		stats = self.metrics.endpoints[USER]
+		self.assertEqual(stats.requests, 1)
+		self.assertEqual(stats.errors, 1)
+		self.assertEqual(stats.status_codes, {})
+		self.assertEqual(stats.latency.count, 1)
+	
+	def test_remove_hook(self):
+		self.client.ctx.remove_hook(self.metrics)
+		self.client.get_user()
+		self.assertEqual(self.metrics.total_requests(), 0)
+
+class PrometheusTest(unittest.TestCase):
+	def test_histogram(self):
+		metrics = MetricsCollector(buckets=(0.1, 0.01), prefix="test")
+		for latency in (0.005, 0.05, 0.05, 20.0):
+			metrics.after_response('GET', "/a", 200, latency, 0, 10)
+		text = metrics.to_prometheus()
+		self.assertIn('test_request_duration_seconds_bucket{method="GET",path="/a",le="0.01"} 1\n', text)
+		self.assertIn('test_request_duration_seconds_bucket{method="GET",path="/a",le="0.1"} 3\n', text)
+		self.assertIn('test_request_duration_seconds_bucket{method="GET",path="/a",le="+Inf"} 4\n', text)
+		self.assertIn('test_request_duration_seconds_count{method="GET",path="/a"} 4\n', text)
+		self.assertIn('test_requests_total{method="GET",path="/a"} 4\n', text)
+		self.assertIn('test_responses_total{method="GET",path="/a",status="200"} 4\n', text)
+		self.assertIn('test_bytes_received_total{method="GET",path="/a"} 40\n', text)
+		self.assertIn("# TYPE test_request_duration_seconds histogram\n", text)
+	
+	def test_label_escaping(self):
+		metrics = MetricsCollector(prefix="test")
+		metrics.on_error('GET', 'a"b\\c', ConnectionError(), 0.0)
+		self.assertIn('test_errors_total{method="GET",path="a\\"b\\\\c"} 1\n', metrics.to_prometheus())
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+tests for subtext.presence, against subtext.testing.MockServer
+"""
+import threading
+import unittest
+
+import subtext
+from subtext.common import RequestHook
+from subtext.presence import PresenceTracker
+from subtext.user import UserPresence
+from subtext.testing import MockServer
+
+class StatusHook(RequestHook):
+	def __init__(self):
+		self.statuses = []
+	def after_response(self, method, path, status_code, latency, bytes_sent, bytes_received):
+		if path == "/Subtext/user/{id}":
+			self.statuses.append(status_code)
+
+class RefreshAllTest(unittest.TestCase):
+	def setUp(self):
+		self.server = MockServer().start()
+		self.addCleanup(self.server.stop)
+		self.server.add_user('test')
+		self.user_ids = [self.server.add_user('user{}'.format(i)) for i in range(10)]
+		
+		self.client = subtext.Client(self.server.url)
+		self.client.login('test', 'password')
+		self.hook = StatusHook()
+		self.client.ctx.add_hook(self.hook)
+	
+	def test_each_entry_once(self):
+		# Every entry is stale again as soon as it is refreshed
+		tracker = PresenceTracker(self.client.ctx, max_age=0, batch_size=3)
+		tracker.watch(self.user_ids)
+		result = tracker.refresh_all()
+		self.assertTrue(result.ok())
+		self.assertEqual(sorted(result.results), sorted(self.user_ids))
+		self.assertEqual(len(self.hook.statuses), 10)
+	
+	def test_revalidates(self):
+		tracker = PresenceTracker(self.client.ctx, max_age=0)
+		tracker.watch(self.user_ids)
+		tracker.refresh_all()
+		names = [tracker.users[x].name for x in self.user_ids]
+		
+		tracker.refresh_all()
+		self.assertEqual(self.hook.statuses, [200] * 10 + [304] * 10)
+		self.assertEqual([tracker.users[x].name for x in self.user_ids], names)
+
+class SetPresenceTest(unittest.TestCase):
+	def setUp(self):
+		self.server = MockServer().start()
+		self.addCleanup(self.server.stop)
+		self.user_id = self.server.add_user('test')
+		
+		self.client = subtext.Client(self.server.url)
+		self.client.login('test', 'password')
+		self.tracker = PresenceTracker(self.client.ctx, coalesce_delay=0.01)
+	
+	def test_coalesced(self):
+		self.tracker.set_presence(UserPresence.away)
+		self.tracker.set_presence(UserPresence.busy)
+		self.tracker.flush()
+		self.assertEqual(self.server.users[self.user_id]['presence'], "Busy")
+	
+	def test_failed_update_kept(self):
+		failed = threading.Event()
+		errors = []
+		def on_error(e):
+			errors.append(e)
+			failed.set()
+		self.tracker.on_error = on_error
+		self.server.inject_error(r"/presence$", "SessionExpired", 401)
+		
+		self.tracker.set_presence(UserPresence.busy)
+		self.assertTrue(failed.wait(5))
+		self.assertEqual(self.tracker.errors, 1)
+		self.assertIsInstance(self.tracker.last_error, subtext.SessionExpired)
+		self.assertEqual(errors, [self.tracker.last_error])
+		
+		# Still pending, so the next flush sends it
+		self.tracker.flush()
+		self.assertEqual(self.server.users[self.user_id]['presence'], "Busy")
+	
+	def test_flush_raises(self):
+		# Sent by the flushes below, not the timer
+		self.tracker.coalesce_delay = 60
+		self.server.inject_error(r"/presence$", "SessionExpired", 401)
+		self.tracker.set_presence(UserPresence.busy)
+		with self.assertRaises(subtext.SessionExpired):
+			self.tracker.flush()
+		self.tracker.flush()
+		self.assertEqual(self.server.users[self.user_id]['presence'], "Busy")
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+tests for subtext.search, against subtext.testing.MockServer
+"""
+import unittest
+
+from datetime import datetime, timedelta, timezone
+
+import subtext
+from subtext import content
+from subtext.search import MessageIndex
+from subtext.testing import MockServer
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+class MessageIndexTest(unittest.TestCase):
+	def setUp(self):
+		self.server = MockServer().start()
+		self.addCleanup(self.server.stop)
+		self.user_id = self.server.add_user('test')
+		self.other_id = self.server.add_user('other')
+		self.board_id = self.server.add_board('test', self.user_id, [self.other_id])
+		self.other_board_id = self.server.add_board('other', self.user_id, [])
+		
+		self.client = subtext.Client(self.server.url)
+		self.client.login('test', 'password')
+		self.index = MessageIndex()
+		self.addCleanup(self.index.close)
+	
+	def add(self, board_id, author_id, text: str, seconds: int):
+		return self.server.add_message(board_id, author_id, content.TextContent(text=text).to_bytes(),
+			type="TextMessage", timestamp=START + timedelta(seconds=seconds)
+		)
+	
+	def search(self, query: str, **kwargs):
+		return [x.message_id for x in self.index.search(query, **kwargs)]
+	
+	def test_update(self):
+		hello = self.add(self.board_id, self.user_id, "hello world", 0)
+		self.add(self.board_id, self.user_id, "goodbye", 1)
+		board = self.client.get_board(self.board_id)
+		
+		self.assertEqual(self.index.update(board), 2)
+		self.assertEqual(self.search("hello"), [hello])
+		self.assertEqual(self.search("missing"), [])
+	
+	def test_incremental_update(self):
+		first = self.add(self.board_id, self.user_id, "hello one", 0)
+		board = self.client.get_board(self.board_id)
+		self.assertEqual(self.index.update(board), 1)
+		self.assertEqual(self.index.update(board), 0)
+		
+		second = self.add(self.board_id, self.user_id, "hello two", 1)
+		self.assertEqual(self.index.update(board), 1)
+		self.assertEqual(sorted(self.search("hello")), sorted([first, second]))
+	
+	def test_filters(self):
+		first = self.add(self.board_id, self.user_id, "hello", 0)
+		second = self.add(self.board_id, self.other_id, "hello", 10)
+		third = self.add(self.other_board_id, self.user_id, "hello", 20)
+		self.index.update(self.client.get_board(self.board_id))
+		self.index.update(self.client.get_board(self.other_board_id))
+		
+		self.assertEqual(sorted(self.search("hello", board=self.board_id)), sorted([first, second]))
+		self.assertEqual(self.search("hello", author=self.other_id), [second])
+		self.assertEqual(sorted(self.search("hello", since_time=START + timedelta(seconds=10))), sorted([second, third]))
+		# Naive times are UTC
+		self.assertEqual(sorted(self.search("hello", until_time=datetime(2024, 1, 1, 0, 0, 10))), sorted([first, second]))
+	
+	def test_compressed(self):
+		text = content.TextContent(text="hello " * 100)
+		wrapped = content.CompressedContent.wrap(text)
+		self.assertIsInstance(wrapped, content.CompressedContent)
+		message_id = self.server.add_message(self.board_id, self.user_id, wrapped.to_bytes(), type=wrapped.canon_type())
+		
+		self.index.update(self.client.get_board(self.board_id))
+		self.assertEqual(self.search("hello"), [message_id])
+
+if __name__ == "__main__":
+	unittest.main()
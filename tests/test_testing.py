@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+tests for subtext.testing.MockServer
+"""
+import unittest
+
+import subtext
+from subtext.testing import MockServer
+
+class MockServerTest(unittest.TestCase):
+	def setUp(self):
+		self.server = MockServer().start()
+		self.addCleanup(self.server.stop)
+		self.user_id = self.server.add_user('test')
+		self.board_id = self.server.add_board('test', self.user_id, [])
+		
+		self.client = subtext.Client(self.server.url)
+		self.client.login('test', 'password')
+	
+	def test_presence(self):
+		self.client.get_user().set_presence(subtext.UserPresence.away)
+		self.assertEqual(self.server.users[self.user_id]['presence'], "Away")
+		
+		# Enum reprs are not presence values
+		with self.assertRaises(subtext.InvalidRequest):
+			self.client.ctx.put("/Subtext/user/{}/presence".format(self.user_id), params={
+				'sessionId': self.client.ctx.session_id(),
+				'presence': "UserPresence.online"
+			})
+		self.assertEqual(self.server.users[self.user_id]['presence'], "Away")
+	
+	def test_unhandled_error(self):
+		with self.assertRaises(subtext.APIError) as cm:
+			self.client.ctx.get("/Subtext/board/{}/messages".format(self.board_id), params={
+				'sessionId': self.client.ctx.session_id(),
+				'sinceTime': "yesterday"
+			})
+		self.assertEqual(cm.exception.status_code, 500)
+		# The connection is still usable
+		self.assertEqual(self.client.get_user().name, 'test')
+
+if __name__ == "__main__":
+	unittest.main()